@@ -0,0 +1,306 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from preon.cancer import download_or_load_do_cancers, load_do_flat_mapping, load_database_cancer_goldstandard, \
+    load_ncbi_cancer_goldstandard
+from preon.drug import load_ebi_drugs, load_charite_drug_goldstandard, load_database_drug_goldstandard, \
+    load_ctg_drug_goldstandard
+from preon.normalization import PrecisionOncologyNormalizer
+
+MATCH_TYPES = ("exact", "substring", "partial", "none")
+PERCENTILES = (50, 90, 99)
+SYNTHETIC_SIZES = (10 ** 4, 10 ** 5, 10 ** 6)
+
+# synthetic names only use the first characters, noise tokens and unmatched queries the others
+NAME_CHARS, NOISE_CHARS = "abcdefghijklmnop", "qrstuvwxyz"
+
+
+def _load_drug_reference():
+    drug_names, chembl_ids = load_ebi_drugs()
+    return drug_names, chembl_ids, dict()
+
+
+def _load_cancer_reference():
+    cancer_types, doids = download_or_load_do_cancers()
+    return cancer_types, doids, dict(id_mapping=load_do_flat_mapping())
+
+
+# name -> (reference loader, gold standard loader, query arguments)
+GOLD_STANDARDS = {
+    "charite_drugs": (_load_drug_reference, load_charite_drug_goldstandard, dict()),
+    "database_drugs": (_load_drug_reference, load_database_drug_goldstandard, dict()),
+    "ctg_drugs": (_load_drug_reference, load_ctg_drug_goldstandard, dict()),
+    "database_cancers": (_load_cancer_reference, load_database_cancer_goldstandard, dict(n_grams=3)),
+    "ncbi_cancers": (_load_cancer_reference, load_ncbi_cancer_goldstandard, dict(n_grams=3)),
+}
+
+
+def synthetic_names(n_names, seed=0):
+    '''
+    Generates random names (5 to 30 characters, some of them with two tokens) with unique ids.
+
+    Parameters
+    -----------
+    :param n_names: the number of names
+    :param seed: the random seed
+    :return: a tupel of names with associated ids.
+
+    Examples
+    -----------
+    >>> names, name_ids = synthetic_names(10000)
+    '''
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(5, 31, size=n_names)
+
+    offsets = np.zeros(n_names + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    table = np.frombuffer(f"{NAME_CHARS} ".encode(), dtype=np.uint8)
+    codes = rng.integers(0, len(NAME_CHARS), size=offsets[-1])
+
+    # a third of the names consist of two tokens
+    two_tokens = np.flatnonzero(rng.random(n_names) < 1 / 3)
+    codes[offsets[two_tokens] + rng.integers(2, lengths[two_tokens] - 2)] = len(NAME_CHARS)
+
+    text = table[codes].tobytes().decode("ascii")
+    offsets = offsets.tolist()
+
+    names = [text[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+    return names, [f"ID{idx}" for idx in range(n_names)]
+
+
+def _noise(rng, min_length, max_length):
+    return "".join(rng.choice(list(NOISE_CHARS), size=rng.integers(min_length, max_length + 1)).tolist())
+
+
+def synthetic_queries(names, n_queries, seed=0):
+    '''
+    Generates queries for synthetic names, a quarter for each match type: names with changed case
+    (exact), names between noise tokens (substring), names with one replaced character (partial)
+    and noise (none).
+
+    Parameters
+    -----------
+    :param names: the synthetic names
+    :param n_queries: the number of queries
+    :param seed: the random seed
+    :return: a list of queries
+
+    Examples
+    -----------
+    >>> names, name_ids = synthetic_names(10000)
+    >>> queries = synthetic_queries(names, 1000)
+    '''
+    rng = np.random.default_rng(seed)
+    sample = [names[idx] for idx in rng.integers(0, len(names), size=8 * n_queries)]
+
+    single_tokens = [name for name in sample if " " not in name]
+    long_names = [name for name in sample if len(name) >= 10]
+    queries = []
+
+    for idx in range(n_queries):
+        if idx % 4 == 0:
+            queries.append(sample[idx].upper())
+        elif idx % 4 == 1:
+            name = single_tokens[idx % len(single_tokens)]
+            queries.append(f"{_noise(rng, 3, 8)} {name} {_noise(rng, 3, 8)}")
+        elif idx % 4 == 2:
+            name = long_names[idx % len(long_names)]
+            pos = rng.integers(len(name))
+            char = NAME_CHARS[(NAME_CHARS.index(name[pos]) + 1) % len(NAME_CHARS)] if name[pos] != " " else " "
+            queries.append(name[:pos] + char + name[pos + 1:])
+        else:
+            queries.append(_noise(rng, 5, 30))
+
+    return queries
+
+
+def _latency_stats(latencies):
+    if len(latencies) == 0:
+        return dict(count=0)
+
+    stats = dict(count=len(latencies), mean=float(np.mean(latencies)), max=float(np.max(latencies)))
+
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        stats[f"p{percentile}"] = float(value)
+
+    return stats
+
+
+def benchmark_normalizer(names, name_ids, queries, engine="scan", batch_size=1024, n_jobs=1, measure_memory=True,
+                         normalizer_args=None, **query_args):
+    '''
+    Measures the fit time, the memory, the per match type query latencies and the batch
+    throughput of a normalizer. Latencies are measured per query (in seconds) and grouped by the
+    match type the query resolved to. A first unmatched query, which passes all stages, is measured
+    separately. The memory is reported after fitting (with its peak during fit) and as retained
+    after the first query, which includes everything the normalizer creates on first use.
+
+    Parameters
+    -----------
+    :param names: the reference names
+    :param name_ids: the associated ids
+    :param queries: the query names
+    :param engine: the partial matching engine of the normalizer
+    :param batch_size: the batch size of transform
+    :param n_jobs: the number of processes of transform
+    :param measure_memory: a flag to decide whether the memory is measured (this fits the normalizer twice)
+    :param normalizer_args: further arguments for the normalizer
+    :param query_args: the arguments passed to the query method
+    :return: a JSON serializable dictionary of results
+
+    Examples
+    -----------
+    >>> names, name_ids = synthetic_names(10000)
+    >>> benchmark_normalizer(names, name_ids, synthetic_queries(names, 1000))
+    '''
+    normalizer_args = dict(enable_warnings=False, engine=engine, **(dict() if normalizer_args is None else normalizer_args))
+    results = dict(engine=engine, n_names=len(names), n_queries=len(queries))
+
+    if measure_memory:
+        # allocations are traced in a separate fit, as tracing slows it down
+        tracemalloc.start()
+        normalizer = PrecisionOncologyNormalizer(**normalizer_args).fit(names, name_ids)
+        fitted, fit_peak = tracemalloc.get_traced_memory()
+
+        normalizer.query(NOISE_CHARS, **query_args)
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        del normalizer
+        results["memory"] = dict(fitted=fitted, fit_peak=fit_peak, retained=retained)
+
+    start = time.perf_counter()
+    normalizer = PrecisionOncologyNormalizer(**normalizer_args).fit(names, name_ids)
+    results["fit_time"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    normalizer.query(NOISE_CHARS, **query_args)
+    results["first_query_time"] = time.perf_counter() - start
+
+    latencies = {match_type: [] for match_type in MATCH_TYPES}
+
+    for query in queries:
+        start = time.perf_counter()
+        res = normalizer.query(query, **query_args)
+        latency = time.perf_counter() - start
+
+        match_type = "none" if res is None or len(res[0]) == 0 else res[2]["match_type"]
+        latencies[match_type].append(latency)
+
+    results["latency"] = {match_type: _latency_stats(latencies[match_type]) for match_type in MATCH_TYPES}
+
+    start = time.perf_counter()
+    normalizer.transform(queries, batch_size=batch_size, n_jobs=n_jobs, **query_args)
+    transform_time = time.perf_counter() - start
+
+    results["throughput"] = dict(batch_size=batch_size, n_jobs=n_jobs, time=transform_time,
+                                 names_per_second=len(queries) / transform_time if transform_time > 0 else None)
+
+    return results
+
+
+def _package_version(package):
+    try:
+        from importlib.metadata import version
+        return version(package)
+    except ImportError:
+        return None
+
+
+def run_benchmarks(sizes=SYNTHETIC_SIZES, gold_standards=tuple(GOLD_STANDARDS), engines=("scan",), n_queries=10000,
+                   seed=0, **benchmark_args):
+    '''
+    Runs the benchmark on synthetic dictionaries of different sizes and on the bundled gold
+    standards. Gold standards whose reference data cannot be loaded (e.g. without network
+    access) are reported with an error instead of results.
+
+    Parameters
+    -----------
+    :param sizes: the numbers of synthetic names
+    :param gold_standards: the names of the gold standards (see GOLD_STANDARDS)
+    :param engines: the partial matching engines
+    :param n_queries: the number of queries for synthetic names
+    :param seed: the random seed for synthetic names and queries
+    :param benchmark_args: the arguments passed to benchmark_normalizer
+    :return: a JSON serializable dictionary of results
+
+    Raises
+    ------
+    ValueError
+        If a gold standard is unknown.
+
+    Examples
+    -----------
+    >>> results = run_benchmarks(sizes=(10000, 100000), gold_standards=("charite_drugs",))
+    '''
+    for name in gold_standards:
+        if name not in GOLD_STANDARDS:
+            raise ValueError(f"Gold standard must be one of: {tuple(GOLD_STANDARDS)}")
+
+    results = dict(
+        meta=dict(created=datetime.now(timezone.utc).isoformat(), preon=_package_version("preon"),
+                  numpy=np.__version__, python=platform.python_version(), platform=platform.platform()),
+        synthetic=[],
+        gold_standards=[],
+    )
+
+    for size in sizes:
+        names, name_ids = synthetic_names(size, seed=seed)
+        queries = synthetic_queries(names, n_queries, seed=seed)
+
+        for engine in engines:
+            results["synthetic"].append(benchmark_normalizer(names, name_ids, queries, engine=engine, **benchmark_args))
+
+    for name in gold_standards:
+        load_reference, load_goldstandard, query_args = GOLD_STANDARDS[name]
+
+        try:
+            names, name_ids, normalizer_args = load_reference()
+            queries = load_goldstandard()[0]
+        except OSError as error:
+            results["gold_standards"].append(dict(name=name, error=str(error)))
+            continue
+
+        for engine in engines:
+            res = benchmark_normalizer(names, name_ids, queries, engine=engine, normalizer_args=normalizer_args,
+                                       **query_args, **benchmark_args)
+            results["gold_standards"].append(dict(name=name, **res))
+
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the latency, throughput and memory of preon.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SYNTHETIC_SIZES),
+                        help="the numbers of synthetic names")
+    parser.add_argument("--gold-standards", nargs="*", default=list(GOLD_STANDARDS), choices=list(GOLD_STANDARDS),
+                        help="the gold standards")
+    parser.add_argument("--engines", nargs="*", default=["scan"], help="the partial matching engines")
+    parser.add_argument("--n-queries", type=int, default=10000, help="the number of queries for synthetic names")
+    parser.add_argument("--batch-size", type=int, default=1024, help="the batch size of transform")
+    parser.add_argument("--n-jobs", type=int, default=1, help="the number of processes of transform")
+    parser.add_argument("--no-memory", action="store_true", help="skip the memory measurement")
+    parser.add_argument("--output", default=None, help="the JSON file for the results (default: stdout)")
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(sizes=args.sizes, gold_standards=args.gold_standards, engines=args.engines,
+                             n_queries=args.n_queries, batch_size=args.batch_size, n_jobs=args.n_jobs,
+                             measure_memory=not args.no_memory)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    A bounded least recently used cache with hit and miss statistics.
+
+    Parameters
+    -----------
+    :param max_size: the maximum number of cached entries
+
+    Examples
+    -----------
+    >>> cache = LRUCache(max_size=2)
+    >>> cache.put("avastin", 1)
+    >>> cache.get("avastin")
+    (True, 1)
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        '''
+        Looks up a key and marks it as recently used.
+
+        Parameters
+        -----------
+        :param key: the key to look up
+        :return: a tupel of a flag whether the key is cached and its value (None if not cached)
+        '''
+        if key not in self.entries:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return True, self.entries[key]
+
+    def put(self, key, value):
+        '''
+        Stores a value and evicts the least recently used entry if the cache is full.
+
+        Parameters
+        -----------
+        :param key: the key to store
+        :param value: the value to store
+        '''
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        '''
+        Removes all entries and resets the statistics.
+        '''
+        self.entries.clear()
+        self.hits, self.misses = 0, 0
+
+    def info(self):
+        '''
+        Returns statistics about the cache.
+
+        :return: a dictionary with the number of hits, misses, cached entries and the maximum size
+        '''
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
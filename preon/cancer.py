@@ -1,57 +1,64 @@
-import os, urllib.request, pronto
+import os
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 
-import pandas as pd
-import daproli as dp
-
-from lxml import etree
+from preon.download import download_file
+from preon.ontology import HierarchyIndex, load_ontology
 
 
 def download_do(file_path=f"{ABS_PATH}/resources/do.obo"):
     '''
-    Downloads and stores the disease ontology.
+    Downloads and stores the disease ontology. The ontology is only downloaded again if it has
+    changed, and interrupted downloads are resumed.
 
     Parameters
     -----------
     :param file_path: the file path at which the disease ontology should be stored.
+    :return: True if the disease ontology was downloaded, False if the stored one is up to date.
 
     Examples
     -----------
     >>> download_do()
     '''
     url = "https://raw.githubusercontent.com/DiseaseOntology/HumanDiseaseOntology/main/src/ontology/doid.obo"
-
-    with urllib.request.urlopen(url) as file:
-        ot = file.read().decode('utf-8')
-
-    with open(file_path, "w") as file:
-        file.write(ot)
+    return download_file(url, file_path)
 
 
 def download_mesh(file_path=f"{ABS_PATH}/resources/mesh.xml"):
     '''
-    Downloads and stores the MeSH data.
+    Downloads and stores the MeSH data. The data is only downloaded again if it has changed,
+    and interrupted downloads are resumed.
 
     Parameters
     -----------
     :param file_path: the file path at which the mesh data should be stored.
+    :return: True if the mesh data was downloaded, False if the stored data is up to date.
 
     Examples
     -----------
     >>> download_mesh()
     '''
     url = "https://nlmpubs.nlm.nih.gov/projects/mesh/MESH_FILES/xmlmesh/desc2022.xml"
+    return download_file(url, file_path)
+
 
-    with urllib.request.urlopen(url) as file:
-        ot = file.read().decode('utf-8')
+def _expand_names(term_ids, term_names, index, expand_ids):
+    # every name maps to its term and (if expanded) to all descendants and ancestors of its term,
+    # which both include the term itself
+    names, ids = [], []
 
-    with open(file_path, "w") as file:
-        file.write(ot)
+    for term_id, term_names in zip(term_ids, term_names):
+        related_ids = [term_id]
+        if expand_ids is True: related_ids += index.descendants(term_id) + index.ancestors(term_id)
+
+        names.extend(term_names * len(related_ids))
+        ids.extend(related_id for related_id in related_ids for _ in term_names)
+
+    return names, ids
 
 
 def load_do_cancers(file_path=f"{ABS_PATH}/resources/do.obo", expand_doids=False):
     '''
-    Loads the disease ontology.
+    Loads the disease ontology. The parsed ontology is cached, see load_ontology.
 
     Parameters
     -----------
@@ -63,75 +70,57 @@ def load_do_cancers(file_path=f"{ABS_PATH}/resources/do.obo", expand_doids=False
     -----------
     >>> cancer_types, doids = load_do_cancers()
     '''
-    ot = pronto.Ontology(file_path)
-
-    cancer_types = []
-    doids = []
-
-    cancer_ids = [term.id for term in ot["DOID:162"].subclasses()]
-
-    for cancer_id in cancer_ids:
-        if cancer_id == "DOID:162": continue
-
-        term = ot[cancer_id]
-        names = [term.name]
-
-        # add doid synonyms
-        for synonym in term.synonyms:
-            if synonym.scope == "EXACT":
-                names.append(synonym.description)
-
-        names = set(names)
-
-        for name in names:
-            cancer_types.append(name)
-            doids.append(term.id)
+    ot = load_ontology(file_path)
+    index = ot.hierarchy_index()
 
-        if expand_doids is False:
-            continue
+    cancer_ids = [cancer_id for cancer_id in index.descendants("DOID:162") if cancer_id != "DOID:162"]
 
-        # add subclasses
-        for subclass in term.subclasses():
-            for name in names:
-                cancer_types.append(name)
-                doids.append(subclass.id)
+    # add doid names and exact synonyms
+    names = [list(set([ot.names[cancer_id]] + ot.synonyms[cancer_id])) for cancer_id in cancer_ids]
 
-        # add superclasses
-        for superclass in term.superclasses():
-            for name in names:
-                cancer_types.append(name)
-                doids.append(superclass.id)
+    return _expand_names(cancer_ids, names, index, expand_doids)
 
-    return cancer_types, doids
 
-
-def load_mesh_cancers(file_path=f"{ABS_PATH}/resources/mesh.xml"):
+def load_mesh_cancers(file_path=f"{ABS_PATH}/resources/mesh.xml", expand_mesh_ids=False):
     '''
     Loads the mesh cancer descriptors.
 
     Parameters
     -----------
     :param file_path: the file path at which the mesh data is stored.
+    :param expand_mesh_ids: a flag to decide whether cancer sub or superclasses (in the C04 tree) should be considered.
     :return: a tupel of mesh descriptors with associated mesh ids.
 
     Examples
     -----------
     >>> disease_types, mesh_ids = load_mesh_cancers()
     '''
-    with open(file_path, 'r') as f:
-        tree = etree.parse(f, etree.HTMLParser())
+    from lxml import etree
 
-    disease_types, mesh_ids = [], []
+    disease_types, mesh_ids, tree_numbers = [], [], []
 
-    for desc_record in tree.getroot().xpath("//descriptorrecord"):
+    # stream over the descriptor records, so that only one record is kept in memory at a time
+    for _, desc_record in etree.iterparse(file_path, events=("end",), tag="DescriptorRecord"):
         # check that record is a neoplasm
-        tree_entries = [entry.text for entry in desc_record.xpath("treenumberlist/treenumber")]
-        if not any(entry.startswith("C04") for entry in tree_entries): continue
+        tree_entries = [entry.text for entry in desc_record.iterfind("TreeNumberList/TreeNumber")
+                        if entry.text.startswith("C04")]
+
+        if len(tree_entries) > 0:
+            disease_types.append(desc_record.findtext("DescriptorName/String"))
+            mesh_ids.append("MESH:" + desc_record.findtext("DescriptorUI"))
+            tree_numbers.append(tree_entries)
+
+        # free the record and the (already processed) records before it
+        desc_record.clear()
 
-        disease_types.append(desc_record.xpath("descriptorname/string")[0].text)
-        mesh_ids.append("MESH:" + desc_record.xpath("descriptorui")[0].text)
+        while desc_record.getprevious() is not None:
+            del desc_record.getparent()[0]
 
-    return disease_types, mesh_ids
+    if expand_mesh_ids is False:
+        return disease_types, mesh_ids
+
+    index = HierarchyIndex.from_tree_numbers(mesh_ids, tree_numbers)
+    return _expand_names(mesh_ids, [[disease_type] for disease_type in disease_types], index, expand_mesh_ids)
 
 
 def download_or_load_do_cancers(file_path=f"{ABS_PATH}/resources/do_cancers.obo", expand_doids=False):
@@ -176,7 +165,7 @@ def download_or_load_mesh_cancers(file_path=f"{ABS_PATH}/resources/mesh.xml"):
 def load_do_flat_mapping(file_path=f"{ABS_PATH}/resources/do_cancers.obo"):
     '''
     Loads a dictionary that maps the first two layers from the cancer disease ontology
-    to all of their sub classes.
+    to all of their sub classes. The parsed ontology is cached, see load_ontology.
 
     Parameters
     -----------
@@ -188,16 +177,18 @@ def load_do_flat_mapping(file_path=f"{ABS_PATH}/resources/do_cancers.obo"):
     -----------
     >>> flat_mapping = load_do_flat_mapping()
     '''
-    ot = pronto.Ontology(file_path)
+    ot = load_ontology(file_path)
     mapping = dict()
 
     start_ids = ["DOID:0050687", "DOID:0050686"]
 
+    index = ot.hierarchy_index()
+
     for start_id in start_ids:
-        for term in ot[start_id].subclasses(distance=1):
-            for sub_term in term.subclasses():
-                if sub_term.id not in mapping: mapping[sub_term.id] = list()
-                mapping[sub_term.id].append(term.id)
+        for term_id in ot.subclasses(start_id, distance=1):
+            for sub_term_id in index.descendants(term_id):
+                if sub_term_id not in mapping: mapping[sub_term_id] = list()
+                mapping[sub_term_id].append(term_id)
 
     return mapping
 
@@ -219,6 +210,8 @@ def apply_do_flat_mapping_to_ontology(cancer_types, doids, do_flat_mapping):
     >>> do_flat_mapping = load_do_flat_mapping()
     >>> cancer_types, doids = apply_do_flat_mapping_to_ontology(cancer_types, doids, do_flat_mapping)
     '''
+    import daproli as dp
+
     doids = dp.map(lambda doid: do_flat_mapping[doid], doids)
     expand_cancer_types, expanded_doids = [], []
 
@@ -248,6 +241,8 @@ def apply_do_flat_mapping_to_goldstandard(cancer_types, doids, do_flat_mapping):
     >>> do_flat_mapping = load_do_flat_mapping()
     >>> cancer_types, doids = apply_do_flat_mapping_to_goldstandard(cancer_types, doids, do_flat_mapping)
     '''
+    import daproli as dp
+
     new_cancer_types, new_doids = [], []
 
     for cancer_type, entries in zip(cancer_types, doids):
@@ -276,24 +271,16 @@ def load_database_cancer_goldstandard(file_path=f"{ABS_PATH}/resources/database_
     -----------
     >>> cancer_types, doids, mesh_ids = load_database_cancer_goldstandard()
     '''
-    df = pd.read_csv(file_path, sep=";")
-    sources, cancer_types, doids, mesh_ids = [], [], [], []
+    import pandas as pd
 
-    for _, (cancer_type, doid, source, mesh_id) in df.iterrows():
-        if doid != doid:
-            doid = [None]
-        else:
-            doid = doid.split(',')
+    df = pd.read_csv(file_path, sep=";", dtype=str)
+    df.columns = ["cancer", "doid", "source", "mesh"]
 
-        if mesh_id != mesh_id:
-            mesh_id = [None]
-        else:
-            mesh_id = mesh_id.split(',')
+    cancer_types, sources = df.cancer.tolist(), df.source.tolist()
 
-        sources.append(source)
-        cancer_types.append(cancer_type)
-        doids.append(doid)
-        mesh_ids.append(mesh_id)
+    # missing ids are represented as [None]
+    doids = [ids if isinstance(ids, list) else [None] for ids in df.doid.str.split(',').tolist()]
+    mesh_ids = [ids if isinstance(ids, list) else [None] for ids in df.mesh.str.split(',').tolist()]
 
     if return_source is True:
         return cancer_types, sources, doids, mesh_ids
@@ -314,6 +301,9 @@ def load_ncbi_cancer_goldstandard(file_path=f"{ABS_PATH}/resources/ncbi_cancer_g
     -----------
     >>> cancer_types, doids, mesh_ids = load_ncbi_cancer_goldstandard()
     '''
+    import pandas as pd
+    import daproli as dp
+
     df = pd.read_csv(file_path, sep=";")
 
     cancer_types, dids, mids = [], [], []
@@ -0,0 +1,266 @@
+import jellyfish
+import numpy as np
+
+MAX_WORD_SIZE = 64
+
+
+def encode_names(names):
+    '''
+    Encodes names as one flat array of character codes (the codes of all names concatenated) with an
+    array of name lengths. Characters are mapped to a dense alphabet, so the codes stay compact, and
+    no name is padded, so a single long name does not inflate the codes of all others.
+
+    Parameters
+    -----------
+    :param names: a list of names
+    :return: a tupel of the concatenated codes, the name lengths and the alphabet that maps characters to codes
+
+    Examples
+    -----------
+    >>> codes, lengths, alphabet = encode_names(["avastin", "isavuconazonium"])
+    '''
+    lengths = np.array([len(name) for name in names], dtype=np.int64)
+    text = "".join(names)
+
+    chars = sorted(set(text))
+    code_points = np.frombuffer(text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+
+    dtype = np.uint8 if len(chars) <= 2 ** 8 else np.uint32
+    codes = np.searchsorted(np.array([ord(char) for char in chars], dtype=np.uint32), code_points).astype(dtype)
+    alphabet = {char: code for code, char in enumerate(chars)}
+
+    return codes, lengths, alphabet
+
+
+def name_offsets(lengths):
+    '''
+    Computes the offsets of encoded names in their concatenated codes.
+
+    Parameters
+    -----------
+    :param lengths: the lengths of the names
+    :return: an array with the start offset of every name and the total length as last element
+
+    Examples
+    -----------
+    >>> name_offsets(np.array([7, 15]))
+    array([ 0,  7, 22])
+    '''
+    return np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(lengths, dtype=np.int64)])
+
+
+def _group_by_length(codes, lengths):
+    # yields the rows of all names of one length with their codes as a matrix, which is only
+    # as wide as these names; the kernels run on one such matrix at a time
+    offsets = name_offsets(lengths)
+    order = np.argsort(lengths, kind="stable")
+    group_lengths, starts = np.unique(lengths[order], return_index=True)
+
+    for length, rows in zip(group_lengths.tolist(), np.split(order, starts[1:])):
+        if rows[-1] - rows[0] + 1 == len(rows):
+            # names of one length that are stored next to each other (e.g. buckets of names sorted by length)
+            matrix = codes[offsets[rows[0]]:offsets[rows[-1] + 1]].reshape(len(rows), length)
+        else:
+            matrix = codes[offsets[rows][:, None] + np.arange(length)]
+
+        # column-major order keeps the characters at one position contiguous for the kernels
+        yield rows, np.asfortranarray(matrix)
+
+
+def _bit_parallel_distances(queries, codes, lengths, alphabet):
+    # Myers' bit-vector algorithm (in Hyyrö's formulation for the global edit distance),
+    # vectorized over queries x names; every query needs to fit into one machine word
+    one = np.uint64(1)
+    q_lengths = np.array([len(query) for query in queries], dtype=np.uint64)
+
+    peq = np.zeros((len(queries), len(alphabet)), dtype=np.uint64)
+
+    for idx, query in enumerate(queries):
+        for pos, char in enumerate(query):
+            if char in alphabet: peq[idx, alphabet[char]] |= one << np.uint64(pos)
+
+    last = (one << (q_lengths - one))[:, None]
+
+    vp = np.full((len(queries), len(lengths)), np.iinfo(np.uint64).max, dtype=np.uint64)
+    vn = np.zeros_like(vp)
+    dists = np.repeat(q_lengths.astype(np.int64)[:, None], len(lengths), axis=1)
+
+    for col in range(lengths.max(initial=0)):
+        eq = peq[:, codes[:, col]]
+        active = lengths > col
+
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+
+        hp = vn | ~(xh | vp)
+        hn = vp & xh
+
+        dists += active & ((hp & last) != 0)
+        dists -= active & ((hn & last) != 0)
+
+        hp = (hp << one) | one
+        hn = hn << one
+
+        vp = hn | ~(xv | hp)
+        vn = hp & xv
+
+    return dists
+
+
+def _bounded_bit_parallel_distances(queries, codes, lengths, alphabet, max_dists):
+    # same recurrence as above, but over a flat list of (query, name) pairs; pairs are dropped
+    # as soon as they are finished or their distance provably exceeds its bound
+    one = np.uint64(1)
+    q_lengths = np.array([len(query) for query in queries], dtype=np.int64)
+
+    peq = np.zeros((len(queries), len(alphabet)), dtype=np.uint64)
+
+    for idx, query in enumerate(queries):
+        for pos, char in enumerate(query):
+            if char in alphabet: peq[idx, alphabet[char]] |= one << np.uint64(pos)
+
+    q_idx, n_idx = np.divmod(np.arange(len(queries) * len(lengths)), len(lengths))
+    dists = (max_dists[:, None] + 1).repeat(len(lengths), axis=1).reshape(-1)
+
+    pairs = np.arange(dists.shape[0])
+    bounds, n_lengths = max_dists[q_idx], lengths[n_idx]
+
+    # the distance is at least the length difference
+    alive = np.abs(q_lengths[q_idx] - n_lengths) <= bounds
+    pairs, q_idx, n_idx, bounds, n_lengths = pairs[alive], q_idx[alive], n_idx[alive], bounds[alive], n_lengths[alive]
+
+    last = one << (q_lengths[q_idx] - 1).astype(np.uint64)
+    score = q_lengths[q_idx]
+
+    # distances never decrease along a diagonal (Ukkonen), so the cell on the diagonal that ends
+    # in the last cell bounds the final distance from below
+    offsets = q_lengths[q_idx] - n_lengths
+    diag = np.maximum(offsets, 0)
+
+    vp = np.full(pairs.shape[0], np.iinfo(np.uint64).max, dtype=np.uint64)
+    vn = np.zeros_like(vp)
+
+    col = 0
+
+    while pairs.shape[0] > 0:
+        finished = n_lengths == col
+        dists[pairs[finished]] = score[finished]
+
+        # remove finished and hopeless pairs once they make up a large share
+        done = (n_lengths <= col) | (diag > bounds)
+
+        if 2 * np.count_nonzero(done) >= done.shape[0]:
+            alive = ~done
+
+            pairs, q_idx, n_idx, bounds, n_lengths, last, score, offsets, diag, vp, vn = (
+                arr[alive] for arr in (pairs, q_idx, n_idx, bounds, n_lengths, last, score, offsets, diag, vp, vn))
+
+            if pairs.shape[0] == 0: break
+
+        eq = peq[q_idx, codes[n_idx, col]]
+
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+
+        hp = vn | ~(xh | vp)
+        hn = vp & xh
+
+        score += (hp & last) != 0
+        score -= (hn & last) != 0
+
+        # advance the diagonal lower bound by one vertical and one horizontal step
+        bits = offsets + col
+        mask = one << np.minimum(np.maximum(bits, 0), MAX_WORD_SIZE - 1).astype(np.uint64)
+
+        step = (vp & mask != 0).view(np.int8) - (vn & mask != 0).view(np.int8)
+        step += (hp & mask != 0).view(np.int8) - (hn & mask != 0).view(np.int8)
+        diag = np.where(bits < 0, col + 1, diag + step)
+
+        hp = (hp << one) | one
+        hn = hn << one
+
+        vp = hn | ~(xv | hp)
+        vn = hp & xv
+
+        col += 1
+
+    return dists.reshape(len(queries), len(lengths))
+
+
+def levenshtein_distances(queries, codes, lengths, alphabet, max_dists=None, max_cells=2 ** 16):
+    '''
+    Computes the Levenshtein distances between many queries and all encoded names at once.
+
+    Parameters
+    -----------
+    :param queries: a list of query names
+    :param codes: the concatenated codes of the names (see encode_names)
+    :param lengths: the lengths of the names
+    :param alphabet: the alphabet that maps characters to codes
+    :param max_dists: optional bounds per query; distances above a bound are not computed exactly,
+    instead they are reported as bound + 1
+    :param max_cells: the maximum number of query-name pairs that are processed at once
+    :return: an integer matrix with one row of distances per query
+
+    Examples
+    -----------
+    >>> codes, lengths, alphabet = encode_names(["avastin", "isavuconazonium"])
+    >>> levenshtein_distances(["isavuconaconium"], codes, lengths, alphabet)
+    array([[11,  1]])
+    '''
+    dists = np.zeros((len(queries), len(lengths)), dtype=np.int64)
+    if len(lengths) == 0: return dists
+
+    word_queries = []
+
+    for idx, query in enumerate(queries):
+        if len(query) == 0:
+            dists[idx] = lengths
+        elif len(query) > MAX_WORD_SIZE:
+            names = decode_names(codes, lengths, alphabet)
+            dists[idx] = [jellyfish.levenshtein_distance(query, name) for name in names]
+        else:
+            word_queries.append(idx)
+
+    if max_dists is not None:
+        max_dists = np.asarray(max_dists, dtype=np.int64)
+
+    for rows, matrix in _group_by_length(codes, lengths):
+        batch_size = max(1, max_cells // len(rows))
+
+        for start in range(0, len(word_queries), batch_size):
+            batch = word_queries[start:start + batch_size]
+            batch_queries = [queries[idx] for idx in batch]
+
+            if max_dists is None:
+                batch_dists = _bit_parallel_distances(batch_queries, matrix, lengths[rows], alphabet)
+            else:
+                batch_dists = _bounded_bit_parallel_distances(batch_queries, matrix, lengths[rows], alphabet,
+                                                              max_dists[batch])
+
+            dists[np.ix_(batch, rows)] = batch_dists
+
+    if max_dists is not None:
+        dists = np.minimum(dists, max_dists[:, None] + 1)
+
+    return dists
+
+
+def decode_names(codes, lengths, alphabet):
+    '''
+    Decodes concatenated codes back into names.
+
+    Parameters
+    -----------
+    :param codes: the concatenated codes of the names (see encode_names)
+    :param lengths: the lengths of the names
+    :param alphabet: the alphabet that maps characters to codes
+    :return: a list of names
+
+    Examples
+    -----------
+    >>> names = decode_names(*encode_names(["avastin", "isavuconazonium"]))
+    '''
+    chars = np.array(sorted(alphabet, key=alphabet.get) or [""])
+    text, offsets = "".join(chars[codes].tolist()), name_offsets(lengths).tolist()
+    return [text[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
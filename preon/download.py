@@ -0,0 +1,131 @@
+import json
+import os
+import urllib.error
+import urllib.request
+import zlib
+
+
+def _read_meta_info(meta_path):
+    if not os.path.exists(meta_path):
+        return dict()
+
+    with open(meta_path, "r") as file:
+        return json.load(file)
+
+
+def _write_meta_info(meta_path, meta_info):
+    # write the meta information atomically as well, so that it always matches the files
+    with open(meta_path + ".tmp", "w") as file:
+        json.dump(meta_info, file)
+
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _validators(headers):
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+
+def _decompress_file(src_path, dst_path, chunk_size):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(chunk_size), b""):
+            dst.write(decompressor.decompress(chunk))
+
+        dst.write(decompressor.flush())
+
+
+def download_file(url, file_path, chunk_size=2 ** 20, gzip=True, timeout=60):
+    '''
+    Downloads a file in chunks into a temporary file and atomically moves it to its destination,
+    so that an interrupted download never leaves a half-written file behind. Validators (ETag and
+    Last-Modified) are stored next to the file, so that unchanged files are not downloaded again
+    (conditional requests) and interrupted downloads continue where they stopped (range requests).
+
+    Parameters
+    -----------
+    :param url: the url of the file
+    :param file_path: the file path at which the file should be stored
+    :param chunk_size: the number of bytes that are read and written at once
+    :param gzip: a flag to decide whether the server may send the file gzip-compressed
+    :param timeout: the timeout (in seconds) for connecting and reading
+    :return: True if the file was downloaded, False if the stored file is up to date
+
+    Raises
+    ------
+    ConnectionError
+        If the connection is closed before the file is complete; the next call resumes the download.
+
+    Examples
+    -----------
+    >>> download_file("https://nlmpubs.nlm.nih.gov/projects/mesh/MESH_FILES/xmlmesh/desc2022.xml", "mesh.xml")
+    '''
+    meta_path, part_path = f"{file_path}.meta.json", f"{file_path}.part"
+    meta_info = _read_meta_info(meta_path)
+    headers, offset = dict(), 0
+
+    # ask for the file only if it has changed since it was stored
+    if os.path.exists(file_path) and meta_info.get("url") == url:
+        if meta_info.get("etag") is not None: headers["If-None-Match"] = meta_info["etag"]
+        if meta_info.get("last_modified") is not None: headers["If-Modified-Since"] = meta_info["last_modified"]
+
+    # continue a partial download if the file has not changed in the meantime
+    part_info = meta_info.get("part", dict())
+    validator = part_info.get("etag") or part_info.get("last_modified")
+
+    if os.path.exists(part_path) and part_info.get("url") == url and validator is not None:
+        offset = os.path.getsize(part_path)
+
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+    if gzip: headers["Accept-Encoding"] = "gzip"
+
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as error:
+        if error.code == 304:
+            return False
+
+        # the partial file is not a prefix of the current file (anymore), start over
+        if error.code == 416 and offset > 0:
+            os.remove(part_path)
+            return download_file(url, file_path, chunk_size=chunk_size, gzip=gzip, timeout=timeout)
+
+        raise
+
+    with response:
+        # the server ignored the range (e.g. because the file changed), so we start over
+        if response.status != 206: offset = 0
+
+        meta_info["part"] = dict(url=url, encoding=response.headers.get("Content-Encoding", "identity"),
+                                 **_validators(response.headers))
+        _write_meta_info(meta_path, meta_info)
+
+        length, n_bytes = response.headers.get("Content-Length"), 0
+
+        with open(part_path, "ab" if offset > 0 else "wb") as file:
+            for chunk in iter(lambda: response.read(chunk_size), b""):
+                file.write(chunk)
+                n_bytes += len(chunk)
+
+            file.flush()
+            os.fsync(file.fileno())
+
+        # a closed connection ends the response early without an error
+        if length is not None and n_bytes != int(length):
+            raise ConnectionError(f"Download of {url} was interrupted after {n_bytes} of {length} bytes.")
+
+    # the partial file stores the transferred bytes, so that ranges refer to the same representation
+    if meta_info["part"]["encoding"] == "gzip":
+        _decompress_file(part_path, f"{file_path}.tmp", chunk_size)
+        os.replace(f"{file_path}.tmp", file_path)
+        os.remove(part_path)
+    else:
+        os.replace(part_path, file_path)
+
+    meta_info = dict(url=url, **_validators(response.headers))
+    _write_meta_info(meta_path, meta_info)
+
+    return True
@@ -5,9 +5,6 @@ ABS_PATH = os.path.dirname(os.path.abspath(__file__))
 EBI_COLS = ["Name", "Synonyms", "ChEMBL ID"]
 DB_COLS = ["Common name", "Synonyms", "DrugBank ID"]
 
-import numpy as np
-import pandas as pd
-
 
 def _store_resource_file(file_path, resource_file_name):
     '''
@@ -50,6 +47,8 @@ def store_ebi_drugs(file_path):
     -----------
     >>> store_ebi_drugs(file_path="/Users/Username/Downloads/compounds.csv")
     '''
+    import pandas as pd
+
     header = pd.read_csv(file_path, delimiter=';', nrows=0)
 
     if not all(column in header.columns for column in EBI_COLS):
@@ -58,6 +57,16 @@ def store_ebi_drugs(file_path):
     _store_resource_file(file_path, "ebi_drugs.csv")
 
 
+def _expand_synonyms(names, synonyms, ids, sep):
+    # one entry per name and synonym, in file order (every name precedes its synonyms)
+    import pandas as pd
+
+    synonyms = synonyms[synonyms.str.len() > 0].str.split(sep).explode()
+    names = pd.concat([names, synonyms]).sort_index(kind="mergesort")
+
+    return names.tolist(), ids.loc[names.index].tolist()
+
+
 def load_ebi_drugs(file_path=f"{ABS_PATH}/resources/ebi_drugs.csv"):
     '''
     Loads and parses EBI drug names downloaded from https://www.ebi.ac.uk/chembl/g/#search_results/compounds.
@@ -71,31 +80,14 @@ def load_ebi_drugs(file_path=f"{ABS_PATH}/resources/ebi_drugs.csv"):
     -----------
     >>> drug_names, chembl_ids = load_ebi_drugs()
     '''
-    df = pd.read_csv(file_path, delimiter=';', low_memory=False, usecols=EBI_COLS)
-
-    # filter df
-    df = df[df.Name.notna() & df["ChEMBL ID"].notna()]
-
-    drug_names, chembl_ids = [], []
-
-    for idx, row in df.iterrows():
-        names = []
+    import pandas as pd
 
-        # check for empty, add name
-        if len(row["Name"]) > 0:
-            names.append(row["Name"])
+    df = pd.read_csv(file_path, delimiter=';', usecols=EBI_COLS, dtype=str)
 
-        # check for nan/empty, add synonyms
-        if isinstance(row["Synonyms"], str) and len(row["Synonyms"]) > 0:
-            for s in row["Synonyms"].split("|"):
-                names.append(s)
-
-        # check for nan/empty, add chembl id
-        if isinstance(row["ChEMBL ID"], str) and len(row["ChEMBL ID"]) > 0:
-            drug_names.extend(names)
-            chembl_ids.extend([row["ChEMBL ID"]] * len(names))
+    # filter df
+    df = df[df.Name.notna() & (df["ChEMBL ID"].str.len() > 0)]
 
-    return drug_names, chembl_ids
+    return _expand_synonyms(df.Name[df.Name.str.len() > 0], df.Synonyms, df["ChEMBL ID"], "|")
 
 
 def store_drugbank_drugs(file_path):
@@ -117,6 +109,8 @@ def store_drugbank_drugs(file_path):
     -----------
     >>> store_drugbank_drugs(file_path="/Users/Username/Downloads/compounds.csv")
     '''
+    import pandas as pd
+
     header = pd.read_csv(file_path, delimiter=',', nrows=0)
 
     if not all(column in header.columns for column in DB_COLS):
@@ -138,22 +132,12 @@ def load_drugbank_drugs(file_path=f"{ABS_PATH}/resources/drugbank_drugs.csv"):
     -----------
     >>> drug_names, db_ids = load_drugbank_drugs()
     '''
-    df = pd.read_csv(file_path, delimiter=',', low_memory=False)
-
-    drug_names, db_ids = [], []
-
-    for _, row in df.iterrows():
-        drug_names.append(row["Common name"])
-        db_ids.append(row["DrugBank ID"])
+    import pandas as pd
 
-        if row["Synonyms"] is np.nan:
-            continue
+    df = pd.read_csv(file_path, delimiter=',', usecols=DB_COLS, dtype=str)
 
-        for synonym in row["Synonyms"].split(" | "):
-            drug_names.append(synonym)
-            db_ids.append(row["DrugBank ID"])
-
-    return drug_names, db_ids
+    # synonyms are separated by " | " (as a regular expression, to support all pandas versions)
+    return _expand_synonyms(df["Common name"], df.Synonyms, df["DrugBank ID"], r" \| ")
 
 
 def load_charite_drug_goldstandard(file_path=f"{ABS_PATH}/resources/charite_drug_goldstandard.csv"):
@@ -169,6 +153,9 @@ def load_charite_drug_goldstandard(file_path=f"{ABS_PATH}/resources/charite_drug
     -----------
     >>> drug_names, chembl_ids = load_charite_drug_goldstandard()
     '''
+    import pandas as pd
+    import numpy as np
+
     df = pd.read_csv(file_path, delimiter=';')
     df = df[df['drug_class'] == 'no']
 
@@ -199,6 +186,8 @@ def load_database_drug_goldstandard(file_path=f"{ABS_PATH}/resources/database_dr
     -----------
     >>> drug_names, chembl_ids = load_database_drug_goldstandard()
     '''
+    import pandas as pd
+
     df = pd.read_csv(file_path, delimiter=";")
     df = df[df['drug_class'] == 'no']
 
@@ -222,6 +211,8 @@ def load_ctg_drug_goldstandard(file_path=f"{ABS_PATH}/resources/ctg_drug_goldsta
     -----------
     >>> drug_names, chembl_ids = load_ctg_drug_goldstandard()
     '''
+    import pandas as pd
+
     df = pd.read_csv(file_path, delimiter=";")
 
     drug_names = df['treatment'].to_numpy().tolist()
@@ -0,0 +1,592 @@
+from collections import Counter
+
+import jellyfish
+import numpy as np
+
+from preon.distance import name_offsets
+from preon.snapshot import encode_strings
+
+# the parameters of the 64-bit FNV-1a hash
+FNV_OFFSET, FNV_PRIME = np.uint64(14695981039346656037), np.uint64(1099511628211)
+
+
+def max_edit_distances(query_length, lengths, threshold, n_decimals=None):
+    '''
+    Computes the largest absolute edit distances between a query and names of given lengths
+    whose normalized (and optionally rounded) distances still satisfy a threshold.
+
+    Parameters
+    -----------
+    :param query_length: the length of the (transformed) query name
+    :param lengths: the lengths of the reference names
+    :param threshold: the normalized edit distance threshold
+    :param n_decimals: the number of decimals normalized distances are rounded to (or None)
+    :return: an array with the largest admissible edit distance per length (-1 if there is none)
+
+    Examples
+    -----------
+    >>> max_edit_distances(15, [12, 15, 18], threshold=.2, n_decimals=3)
+    array([3, 3, 3])
+    '''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    max_lengths = np.maximum(np.maximum(lengths, query_length), 1)
+
+    def normalize(dists):
+        dists = dists / max_lengths
+        return dists if n_decimals is None else np.round(dists, n_decimals)
+
+    dists = np.clip(np.floor(threshold * max_lengths), -1, max_lengths).astype(np.int64)
+
+    # correct for floating point and rounding effects in both directions
+    while True:
+        grow = (dists < max_lengths) & (normalize(dists + 1) <= threshold)
+        if not grow.any(): break
+        dists[grow] += 1
+
+    while True:
+        shrink = (dists >= 0) & (normalize(dists) > threshold)
+        if not shrink.any(): break
+        dists[shrink] -= 1
+
+    return dists
+
+
+class BKTree:
+    '''
+    A Burkhard-Keller tree that indexes names in the Levenshtein metric space. Range
+    queries only visit subtrees that can contain names within the search radius.
+
+    Examples
+    -----------
+    >>> tree = BKTree(["isavuconazonium", "avastin"])
+    >>> tree.search("isavuconaconium", radius=1)
+    (['isavuconazonium'], [1], 1)
+    '''
+
+    def __init__(self, names=()):
+        self.root = None
+
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        '''
+        Inserts a name into the tree (duplicates are ignored).
+
+        Parameters
+        -----------
+        :param name: the name to insert
+        '''
+        if self.root is None:
+            self.root = (name, dict())
+            return
+
+        node_name, children = self.root
+
+        while True:
+            dist = jellyfish.levenshtein_distance(name, node_name)
+            if dist == 0: return
+
+            if dist not in children:
+                children[dist] = (name, dict())
+                return
+
+            node_name, children = children[dist]
+
+    def to_arrays(self, name_rows):
+        '''
+        Flattens the tree into arrays (in breadth-first order), e.g. to store it in a snapshot.
+
+        Parameters
+        -----------
+        :param name_rows: a dictionary that maps every indexed name to an integer row
+        :return: a tupel of the name rows, parent positions (-1 for the root) and edge distances of all nodes
+        '''
+        rows, parents, dists = [], [], []
+        nodes = [] if self.root is None else [(self.root, -1, 0)]
+
+        for pos, ((node_name, children), parent, dist) in enumerate(nodes):
+            rows.append(name_rows[node_name])
+            parents.append(parent)
+            dists.append(dist)
+
+            nodes.extend((child, pos, child_dist) for child_dist, child in children.items())
+
+        return np.array(rows, dtype=np.int64), np.array(parents, dtype=np.int64), np.array(dists, dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, names, rows, parents, dists):
+        '''
+        Restores a tree from the arrays created by to_arrays, without computing any distances.
+
+        Parameters
+        -----------
+        :param names: the names that the rows refer to
+        :param rows: the name rows of all nodes
+        :param parents: the parent positions of all nodes
+        :param dists: the edge distances of all nodes
+        :return: the restored tree
+        '''
+        tree, nodes = cls(), []
+
+        for row, parent, dist in zip(rows.tolist(), parents.tolist(), dists.tolist()):
+            node = (names[row], dict())
+            nodes.append(node)
+
+            if parent == -1:
+                tree.root = node
+            else:
+                nodes[parent][1][dist] = node
+
+        return tree
+
+    def search(self, name, radius):
+        '''
+        Finds all indexed names within an edit distance radius.
+
+        Parameters
+        -----------
+        :param name: the query name
+        :param radius: the maximum (absolute) edit distance
+        :return: a tupel of the indexed names within the radius, their edit distances and
+        the number of computed edit distances
+        '''
+        if self.root is None or radius < 0:
+            return [], [], 0
+
+        matches, distances, nodes, n_computations = [], [], [self.root], 0
+
+        while len(nodes) > 0:
+            node_name, children = nodes.pop()
+            dist = jellyfish.levenshtein_distance(name, node_name)
+            n_computations += 1
+
+            if dist <= radius:
+                matches.append(node_name)
+                distances.append(dist)
+
+            # triangle inequality: only children with |child_dist - dist| <= radius qualify
+            for child_dist, child in children.items():
+                if dist - radius <= child_dist <= dist + radius:
+                    nodes.append(child)
+
+        return matches, distances, n_computations
+
+
+def _hash_strings(strings):
+    # 64-bit FNV-1a hashes of the UTF-8 encoded strings, which (unlike hash) are the same in every process;
+    # strings are hashed from the longest to the shortest, so the strings longer than pos come first
+    data, offsets = encode_strings(strings)
+    lengths = np.diff(offsets)
+
+    order = np.argsort(lengths, kind="stable")[::-1]
+    lengths, starts = lengths[order], offsets[:-1][order]
+    hashes = np.full(len(order), FNV_OFFSET, dtype=np.uint64)
+
+    for pos in range(lengths[0] if len(order) > 0 else 0):
+        n_active = len(order) - np.searchsorted(lengths[::-1], pos, side="right")
+        hashes[:n_active] = (hashes[:n_active] ^ data[starts[:n_active] + pos]) * FNV_PRIME
+
+    result = np.empty_like(hashes)
+    result[order] = hashes
+    return result
+
+
+def _deletes(name, max_deletes):
+    deletes, level = {name}, {name}
+
+    for _ in range(max_deletes):
+        level = {word[:idx] + word[idx + 1:] for word in level for idx in range(len(word))}
+        deletes |= level
+
+    return deletes
+
+
+class SymSpellIndex:
+    '''
+    A symmetric delete index (as in SymSpell) that maps every variant of a name with up to
+    max_edit_distance deleted characters to the names it originates from. Range queries
+    probe the deletion variants of the query and verify the candidates, instead of
+    comparing the query against every name.
+
+    The index trades memory for speed: a name of length n produces O(n^k) deletion
+    variants for k = max_edit_distance, so fitting and memory grow quickly with k.
+    Names further away than max_edit_distance edits cannot be found. An index restored
+    from a snapshot keeps the stored variants in (memory-mapped) arrays, with names added
+    afterwards in a dictionary.
+
+    Examples
+    -----------
+    >>> index = SymSpellIndex(["isavuconazonium", "avastin"], max_edit_distance=2)
+    >>> index.search("isavuconaconium", radius=2)
+    (['isavuconazonium'], [1], 1)
+    '''
+
+    def __init__(self, names=(), max_edit_distance=2):
+        self.max_edit_distance = max_edit_distance
+        self.deletes = dict()
+
+        # the stored variants of a restored index: sorted hashes and the name rows per hash in CSR format
+        self._names, self._hashes = [], np.zeros(0, dtype=np.uint64)
+        self._offsets, self._rows = np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        '''
+        Inserts a name and all of its deletion variants into the index.
+
+        Parameters
+        -----------
+        :param name: the name to insert
+        '''
+        for delete in _deletes(name, self.max_edit_distance):
+            if delete not in self.deletes: self.deletes[delete] = list()
+            self.deletes[delete].append(name)
+
+    def remove(self, name):
+        '''
+        Removes a name from the index, which only touches its own deletion variants. Names
+        restored from a snapshot cannot be removed, their search results need to be filtered.
+
+        Parameters
+        -----------
+        :param name: the name to remove
+        '''
+        for delete in _deletes(name, self.max_edit_distance):
+            names = self.deletes.get(delete, [])
+            if name in names: names.remove(name)
+            if len(names) == 0: self.deletes.pop(delete, None)
+
+    def to_arrays(self, name_rows):
+        '''
+        Flattens the index into arrays, e.g. to store it in a snapshot. Deletion variants are
+        stored by their 64-bit hashes, so the arrays do not hold any strings.
+
+        Parameters
+        -----------
+        :param name_rows: a dictionary that maps every indexed name to an integer row
+        :return: a tupel of the sorted variant hashes, the posting offsets per hash and the name rows of all postings
+        '''
+        deletes, rows = [], []
+
+        for delete, names in self.deletes.items():
+            for name in names:
+                deletes.append(delete)
+                rows.append(name_rows[name])
+
+        hashes, rows = _hash_strings(deletes), np.array(rows, dtype=np.int64)
+
+        # restored variants keep their hashes, unless their names are not indexed anymore
+        if len(self._hashes) > 0:
+            restored = np.array([name_rows.get(name, -1) for name in self._names], dtype=np.int64)[self._rows]
+            hashes = np.concatenate([hashes, np.repeat(self._hashes, np.diff(self._offsets))[restored >= 0]])
+            rows = np.concatenate([rows, restored[restored >= 0]])
+
+        # deduplicated postings in CSR format, sorted by hash and row
+        order = np.lexsort((rows, hashes))
+        hashes, rows = hashes[order], rows[order]
+
+        distinct = np.ones(len(rows), dtype=bool)
+        distinct[1:] = (hashes[1:] != hashes[:-1]) | (rows[1:] != rows[:-1])
+        hashes, rows = hashes[distinct], rows[distinct]
+
+        hashes, starts = np.unique(hashes, return_index=True)
+        offsets = np.append(starts, len(rows)).astype(np.int64)
+
+        dtype = np.int32 if len(name_rows) < 2 ** 31 else np.int64
+        return hashes, offsets, rows.astype(dtype)
+
+    @classmethod
+    def from_arrays(cls, names, hashes, offsets, rows, max_edit_distance=2):
+        '''
+        Restores an index from the arrays created by to_arrays, without generating any deletion variants.
+
+        Parameters
+        -----------
+        :param names: the names that the rows refer to
+        :param hashes: the sorted variant hashes
+        :param offsets: the posting offsets per hash
+        :param rows: the name rows of all postings
+        :param max_edit_distance: the maximum number of deleted characters of the stored variants
+        :return: the restored index
+        '''
+        index = cls(max_edit_distance=max_edit_distance)
+        index._names, index._hashes, index._offsets, index._rows = names, hashes, offsets, rows
+        return index
+
+    def search(self, name, radius):
+        '''
+        Finds all indexed names within an edit distance radius (capped at max_edit_distance).
+
+        Parameters
+        -----------
+        :param name: the query name
+        :param radius: the maximum (absolute) edit distance
+        :return: a tupel of the indexed names within the radius, their edit distances and
+        the number of computed edit distances
+        '''
+        radius = min(radius, self.max_edit_distance)
+        deletes, candidates = _deletes(name, radius), set()
+
+        for delete in deletes:
+            candidates.update(self.deletes.get(delete, ()))
+
+        # variants with equal hashes share their postings, which only adds candidates
+        if len(self._hashes) > 0:
+            hashes = _hash_strings(list(deletes))
+            pos = np.minimum(np.searchsorted(self._hashes, hashes), len(self._hashes) - 1)
+            pos = pos[self._hashes[pos] == hashes]
+
+            for start, stop in zip(self._offsets[pos].tolist(), self._offsets[pos + 1].tolist()):
+                candidates.update(self._names[row] for row in self._rows[start:stop].tolist())
+
+        # the length difference is a lower bound of the edit distance
+        candidates = [candidate for candidate in candidates if abs(len(candidate) - len(name)) <= radius]
+        distances = [jellyfish.levenshtein_distance(name, candidate) for candidate in candidates]
+        matches = [(candidate, dist) for candidate, dist in zip(candidates, distances) if dist <= radius]
+
+        return [candidate for candidate, _ in matches], [dist for _, dist in matches], len(candidates)
+
+
+def _qgrams(name, q):
+    # pad the name, so that every character (also at the borders) is covered by q q-grams
+    padded = "\x02" * (q - 1) + name + "\x03" * (q - 1)
+    return [padded[idx:idx + q] for idx in range(len(padded) - q + 1)]
+
+
+class QGramIndex:
+    '''
+    An inverted index that maps the (padded) q-grams of names to the names that contain them.
+    Range queries only return names that pass the count filter: two names within k edits
+    share at least max(m, n) + q - 1 - k * q q-grams, as every edit destroys at most q of them.
+    The returned candidates still need to be verified with the exact edit distance.
+
+    Parameters
+    -----------
+    :param names: the names to index
+    :param q: the length of the q-grams
+
+    Examples
+    -----------
+    >>> index = QGramIndex(["isavuconazonium", "avastin"], q=3)
+    >>> index.search("isavuconaconium", radii={15: 3})
+    ['isavuconazonium']
+    '''
+
+    def __init__(self, names=(), q=3):
+        self.q = q
+        self.names = list(names)
+        self.lengths = np.array([len(name) for name in self.names], dtype=np.int64)
+        self.grams = dict()
+
+        gram_ids, rows = [], []
+
+        for row, name in enumerate(self.names):
+            for gram in _qgrams(name, q):
+                gram_ids.append(self.grams.setdefault(gram, len(self.grams)))
+                rows.append(row)
+
+        # postings in CSR format: the rows that contain a q-gram, with the number of its occurrences
+        n_rows = max(len(self.names), 1)
+        pairs, counts = np.unique(np.array(gram_ids, dtype=np.int64) * n_rows + np.array(rows, dtype=np.int64),
+                                  return_counts=True)
+        gram_ids, rows = np.divmod(pairs, n_rows)
+
+        self.offsets = np.zeros(len(self.grams) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(self.grams)), out=self.offsets[1:])
+
+        dtype = np.int32 if len(self.names) < 2 ** 31 else np.int64
+        self.rows, self.counts = rows.astype(dtype), counts.astype(np.int32)
+        self._index_lengths()
+
+    def _index_lengths(self):
+        # rows grouped by length, for lengths that the count filter cannot prune
+        self._length_order = np.argsort(self.lengths, kind="stable")
+        lengths, starts = np.unique(self.lengths[self._length_order], return_index=True)
+        stops = np.append(starts[1:], len(self.names))
+        self._length_buckets = {length: (start, stop) for length, start, stop in zip(lengths.tolist(), starts, stops)}
+
+    def to_arrays(self):
+        '''
+        Returns the q-grams and the postings of the index, e.g. to store them in a snapshot.
+
+        :return: a tupel of the q-grams (ordered by their ids), the posting offsets per q-gram and
+        the rows and occurrence counts of all postings
+        '''
+        return list(self.grams), self.offsets, self.rows, self.counts
+
+    @classmethod
+    def from_arrays(cls, names, grams, offsets, rows, counts, q=3):
+        '''
+        Restores an index from the arrays returned by to_arrays, without extracting any q-grams.
+
+        Parameters
+        -----------
+        :param names: the indexed names, in the order of their rows
+        :param grams: the q-grams, ordered by their ids
+        :param offsets: the posting offsets per q-gram
+        :param rows: the rows of all postings
+        :param counts: the occurrence counts of all postings
+        :param q: the length of the q-grams
+        :return: the restored index
+        '''
+        index = cls(q=q)
+        index.names = list(names)
+        index.lengths = np.array([len(name) for name in index.names], dtype=np.int64)
+        index.grams = {gram: gram_id for gram_id, gram in enumerate(grams)}
+        index.offsets, index.rows, index.counts = offsets, rows, counts
+
+        index._index_lengths()
+        return index
+
+    def search(self, name, radii):
+        '''
+        Finds all indexed names that pass the count filter for their length.
+
+        Parameters
+        -----------
+        :param name: the query name
+        :param radii: a dictionary that maps name lengths to the maximum (absolute) edit distance;
+        names of other lengths are not returned
+        :return: a list of candidate names
+        '''
+        lengths, radii = np.array(list(radii), dtype=np.int64), np.array(list(radii.values()), dtype=np.int64)
+        min_common = np.maximum(lengths, len(name)) + self.q - 1 - radii * self.q
+
+        matches = []
+
+        # names of lengths without a positive lower bound on common q-grams are all candidates
+        for length in lengths[min_common <= 0].tolist():
+            start, stop = self._length_buckets.get(length, (0, 0))
+            matches.append(self._length_order[start:stop])
+
+        rows, common = [], []
+
+        for gram, count in Counter(_qgrams(name, self.q)).items():
+            if gram not in self.grams: continue
+
+            start, stop = self.offsets[self.grams[gram]], self.offsets[self.grams[gram] + 1]
+            rows.append(self.rows[start:stop])
+            common.append(np.minimum(self.counts[start:stop], count))
+
+        if len(rows) > 0 and np.any(min_common > 0):
+            rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+            common = np.bincount(inverse, weights=np.concatenate(common))
+
+            table = np.full(max(self.lengths.max(), lengths.max()) + 1, np.inf)
+            table[lengths[min_common > 0]] = min_common[min_common > 0]
+            matches.append(rows[common >= table[self.lengths[rows]]])
+
+        return [self.names[row] for row in np.concatenate(matches, dtype=np.int64).tolist()] if matches else []
+
+
+class PrefixTrie:
+    '''
+    A trie over a set of encoded names, stored in flat arrays: the transitions of all nodes form
+    one sorted array of (parent node, character code) keys, so that the child of a node is found
+    by binary search and the trie can be stored in (and memory-mapped from) a snapshot. Searches
+    walk the trie from many start positions of a text at once.
+
+    Parameters
+    -----------
+    :param codes: the concatenated codes of the names (as returned by encode_names)
+    :param lengths: the lengths of the names
+    :param alphabet: the alphabet that maps characters to codes
+
+    Examples
+    -----------
+    >>> trie = PrefixTrie(*encode_names(["ixabepilone", "epothiloneb", "b"]))
+    >>> trie.search("ixabepiloneepothiloneb", starts=[0, 11, 21])
+    [(21, 22), (0, 11), (11, 22)]
+    '''
+
+    def __init__(self, codes=None, lengths=None, alphabet=None):
+        self.alphabet = dict() if alphabet is None else alphabet
+        lengths = np.zeros(0, dtype=np.int64) if lengths is None else np.asarray(lengths, dtype=np.int64)
+        n_codes = max(len(self.alphabet), 1)
+
+        # node 0 is the root; the nodes of a depth are created together and numbered after all nodes of
+        # smaller depths, so the keys (parent * n_codes + code) of all depths concatenate to a sorted array
+        # and the child of the transition at position idx is node idx + 1
+        order = np.argsort(lengths, kind="stable")[::-1]
+        sorted_lengths, starts = lengths[order], name_offsets(lengths)[order]
+        nodes = np.zeros(len(order), dtype=np.int64)
+        keys, terminal, n_nodes = [np.zeros(0, dtype=np.int64)], [np.zeros(1, dtype=bool)], 1
+
+        for depth in range(sorted_lengths[0] if len(order) > 0 else 0):
+            # names are ordered from the longest to the shortest, those longer than depth come first
+            n_active = len(order) - np.searchsorted(sorted_lengths[::-1], depth, side="right")
+            pairs = nodes[:n_active] * n_codes + codes[starts[:n_active] + depth]
+
+            level_keys, inverse = np.unique(pairs, return_inverse=True)
+            nodes[:n_active] = n_nodes + inverse.reshape(-1)
+
+            level_terminal = np.zeros(len(level_keys), dtype=bool)
+            level_terminal[inverse.reshape(-1)[sorted_lengths[:n_active] == depth + 1]] = True
+
+            keys.append(level_keys)
+            terminal.append(level_terminal)
+            n_nodes += len(level_keys)
+
+        dtype = np.int32 if n_nodes * n_codes < 2 ** 31 else np.int64
+        self.keys, self.terminal = np.concatenate(keys).astype(dtype), np.concatenate(terminal)
+
+    @classmethod
+    def from_arrays(cls, keys, terminal, alphabet):
+        '''
+        Restores a trie from its arrays (e.g. stored in a snapshot).
+
+        Parameters
+        -----------
+        :param keys: the sorted transition keys
+        :param terminal: the flags of the nodes at which a name ends
+        :param alphabet: the alphabet that maps characters to codes
+        :return: the restored trie
+        '''
+        trie = cls(alphabet=alphabet)
+        trie.keys, trie.terminal = keys, terminal
+        return trie
+
+    def search(self, text, starts, stops=None):
+        '''
+        Finds all occurrences of the indexed names in a text that begin at given start positions.
+
+        Parameters
+        -----------
+        :param text: the text to search in
+        :param starts: the start positions of occurrences
+        :param stops: an optional array with the largest stop position of occurrences, per start position
+        :return: a list of (start, stop) positions of all occurrences, ordered by their lengths
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = np.full(len(starts), len(text)) if stops is None else np.minimum(stops, len(text))
+
+        if len(self.keys) == 0:
+            return []
+
+        # characters outside of the alphabet have no transitions
+        codes = np.array([self.alphabet.get(char, -1) for char in text], dtype=np.int64)
+        n_codes = max(len(self.alphabet), 1)
+
+        active = starts < stops
+        starts, stops = starts[active], stops[active]
+        nodes, positions, matches = np.zeros(len(starts), dtype=np.int64), starts.copy(), []
+
+        while len(positions) > 0:
+            chars = codes[positions]
+            keys = (nodes * n_codes + chars).astype(self.keys.dtype)
+            idx = np.searchsorted(self.keys, keys)
+
+            found = chars >= 0
+            found[found] = self.keys[np.minimum(idx[found], len(self.keys) - 1)] == keys[found]
+
+            nodes, positions, starts, stops = idx[found] + 1, positions[found] + 1, starts[found], stops[found]
+            hits = np.flatnonzero(self.terminal[nodes])
+            matches.extend(zip(starts[hits].tolist(), positions[hits].tolist()))
+
+            active = positions < stops
+            nodes, positions, starts, stops = nodes[active], positions[active], starts[active], stops[active]
+
+        return matches
@@ -0,0 +1,84 @@
+import heapq
+from itertools import count
+
+STAGES = ("normalize", "exact", "substring", "partial")
+
+
+class MetricsRecorder:
+    '''
+    A metrics callback for the normalizer, which aggregates the query records per stage and
+    match type and keeps the slowest queries to find pathological inputs.
+
+    Parameters
+    -----------
+    :param n_slowest: the number of slowest query records to keep
+
+    Examples
+    -----------
+    >>> recorder = MetricsRecorder()
+    >>> normalizer = PrecisionOncologyNormalizer(metrics=recorder).fit(drug_names, chembl_ids)
+    >>> normalizer.query("Avastin")
+    >>> recorder.summary()["match_types"]
+    {'exact': 1}
+    '''
+
+    def __init__(self, n_slowest=10):
+        self.n_slowest = n_slowest
+        self.clear()
+
+    def __call__(self, record):
+        '''
+        Adds a query record.
+
+        Parameters
+        -----------
+        :param record: the query record of the normalizer
+        '''
+        self.n_queries += 1
+        self.cache_hits += record["cache_hit"]
+        self.candidates += record["candidates"]
+        self.distance_computations += record["distance_computations"]
+        self.match_types[record["match_type"]] = self.match_types.get(record["match_type"], 0) + 1
+
+        for stage, stage_time in record["stages"].items():
+            self.stage_times[stage] = self.stage_times.get(stage, 0.) + stage_time
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+        # a min heap of the slowest records, the counter breaks ties between equal times
+        entry = record["time"], next(self._counter), record
+
+        if len(self._slowest) < self.n_slowest:
+            heapq.heappush(self._slowest, entry)
+        elif self.n_slowest > 0 and entry[0] > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def clear(self):
+        '''
+        Removes all records.
+        '''
+        self.n_queries, self.cache_hits, self.candidates, self.distance_computations = 0, 0, 0, 0
+        self.match_types, self.stage_times, self.stage_counts = dict(), dict(), dict()
+        self._slowest, self._counter = [], count()
+
+    def slowest(self):
+        '''
+        Returns the records of the slowest queries.
+
+        :return: a list of query records, from the slowest to the fastest
+        '''
+        return [record for _, _, record in sorted(self._slowest, key=lambda entry: (-entry[0], entry[1]))]
+
+    def summary(self):
+        '''
+        Summarizes the recorded queries.
+
+        :return: a dictionary with the number of queries and cache hits, the number of queries per match type,
+        the total and mean wall-clock time (in seconds) per stage, the number of candidates and edit distance
+        computations, and the records of the slowest queries
+        '''
+        stages = {stage: {"total": self.stage_times[stage], "mean": self.stage_times[stage] / self.stage_counts[stage],
+                          "count": self.stage_counts[stage]} for stage in STAGES if stage in self.stage_counts}
+
+        return {"n_queries": self.n_queries, "cache_hits": self.cache_hits, "match_types": dict(self.match_types),
+                "stages": stages, "candidates": self.candidates, "distance_computations": self.distance_computations,
+                "slowest": self.slowest()}
@@ -1,18 +1,136 @@
+import os
 import re
 import time
 import warnings
+from bisect import bisect_left
+from collections.abc import Mapping
+from itertools import islice
 
 import jellyfish
 import numpy as np
-import pandas as pd
-from nltk import ngrams
-from tqdm import tqdm
+
+from preon.cache import LRUCache
+from preon.distance import encode_names, levenshtein_distances, name_offsets
+from preon.index import BKTree, PrefixTrie, QGramIndex, SymSpellIndex, max_edit_distances
+from preon.snapshot import decode_strings, encode_strings, fingerprint, read_snapshot, write_snapshot
+
+ENGINES = ("scan", "bktree", "symspell", "qgram")
+TRANSFORM_COLUMNS = ["Name", "Found Names", "Found Name IDs", "Match Type", "Edit Distance", "Query Time"]
+
+# incremental updates are merged into the fitted data once they exceed this share of names
+COMPACTION_RATIO = .1
+COMPACTION_MIN_SIZE = 1024
+
+# substring queries with up to this many n-grams probe the names directly instead of walking the tries
+SUBSTRING_PROBE_LIMIT = 2048
+
+# ids of multiple vocabularies are interned as "<source><separator><id>" strings
+SOURCE_SEPARATOR = "\x1f"
+
+_worker_normalizer = None
+
+
+def _init_worker(normalizer):
+    global _worker_normalizer
+    _worker_normalizer = normalizer
+
+
+def _build_postings(rows, ids, n_rows, n_ids):
+    # deduplicated postings per row in CSR format (offsets and ids), sorted by row and id
+    pairs = np.unique(rows * n_ids + ids)
+    rows, ids = np.divmod(pairs, max(n_ids, 1))
+
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=offsets[1:])
+
+    dtype = np.int32 if n_ids < 2 ** 31 else np.int64
+    return offsets, ids.astype(dtype)
+
+
+def _copy_result(res):
+    if res is None:
+        return None
+
+    found_names, name_ids, meta_info = res
+    return list(found_names), [list(ids) for ids in name_ids], dict(meta_info)
+
+
+def _query_batch_worker(args):
+    batch, query_args, collect = args
+
+    if not collect:
+        return _worker_normalizer._query_batch(batch, **query_args), None
+
+    # the records are passed on to the metrics callback in the parent process
+    records = []
+    _worker_normalizer.metrics = records.append
+
+    try:
+        return _worker_normalizer._query_batch(batch, **query_args), records
+    finally:
+        _worker_normalizer.metrics = None
+
+
+def _new_record(query_name):
+    return {"name": query_name, "match_type": "none", "cache_hit": False, "time": 0., "stages": dict(),
+            "candidates": 0, "distance_computations": 0}
+
+
+class _NameIds(Mapping):
+    # a read-only view of the fitted names and their ids; the ids of a name are materialized
+    # from the postings when it is accessed, so the view costs no memory of its own
+
+    def __init__(self, normalizer):
+        self._normalizer = normalizer
+
+    def __getitem__(self, name):
+        if name not in self._normalizer._rows: raise KeyError(name)
+
+        name_ids = self._normalizer._get_name_ids(name)
+        if self._normalizer.sources is None: return name_ids
+
+        grouped = dict()
+
+        for name_id in name_ids:
+            source, _, name_id = name_id.partition(SOURCE_SEPARATOR)
+            grouped.setdefault(source, []).append(name_id)
+
+        return grouped
+
+    def __iter__(self):
+        return iter(self._normalizer._rows)
+
+    def __len__(self):
+        return len(self._normalizer._rows)
+
+    def __contains__(self, name):
+        return name in self._normalizer._rows
 
 
 class PrecisionOncologyNormalizer:
     '''
     Provides normalization and search functionality for names with associated ids.
 
+    Parameters
+    -----------
+    :param enable_warnings: a flag to decide whether unmatched queries issue a user warning
+    :param engine: the partial matching engine, either "scan" (length-bucketed scan over all
+    names), "bktree" (BK-tree range search, slower to fit but visits fewer names per query),
+    "symspell" (symmetric delete index, fastest lookups but large memory footprint) or "qgram"
+    (trigram inverted index, only verifies names that share enough trigrams with the query)
+    :param max_edit_distance: the maximum number of edits the "symspell" engine can match; fit time
+    and memory grow exponentially with it and partial matches further away are not found
+    :param cache_size: the maximum number of query results kept in an LRU cache (None disables caching);
+    the cache is cleared whenever the normalizer is fitted
+    :param id_mapping: an optional mapping that is applied to the ids of matched names at query time, either
+    a dictionary from ids to lists of ids (ids without an entry are dropped, e.g. a DO flat mapping) or an object
+    with an expand method that returns the related ids of an id (e.g. a HierarchyIndex); the fitted names keep
+    their original ids, instead of one copy per mapped id, and names without any mapped id are not matched
+    :param metrics: an optional callback (e.g. a MetricsRecorder) that is called with a record for every distinct
+    query: the wall-clock time (in seconds) of each stage (normalize, exact, substring and partial), the number of
+    candidate names and edit distance computations of the partial stage, whether the result came from the cache
+    and the match type; the callback is not pickled and runs in the calling process
+
     Examples
     -----------
     >>> drug_names, chembl_ids = load_ebi_drugs()
@@ -21,8 +139,40 @@ class PrecisionOncologyNormalizer:
     (['avastin'], [['CHEMBL1201583']], {'match_type': 'exact'})
     '''
 
-    def __init__(self, enable_warnings=True):
+    def __init__(self, enable_warnings=True, engine="scan", max_edit_distance=2, cache_size=None, id_mapping=None,
+                 metrics=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Partial matching engine must be one of: {ENGINES}")
+
         self.enable_warnings = enable_warnings
+        self.engine = engine
+        self.max_edit_distance = max_edit_distance
+        self.cache_size = cache_size
+        self.id_mapping = id_mapping
+        self.metrics = metrics
+        self.sources = None
+        self._query_cache = LRUCache(cache_size) if cache_size else None
+
+    def __getstate__(self):
+        # callbacks are often not picklable (e.g. lambdas), worker processes return their records instead
+        state = self.__dict__.copy()
+        state["metrics"] = None
+        return state
+
+    @property
+    def names(self):
+        '''
+        The fitted (normalized) names with their ids, as a read-only mapping from every name to the sorted list
+        of its ids (grouped by source for multiple vocabularies). The id mapping is not applied, and the mapping
+        reflects names added by partial_fit or removed by remove.
+
+        Examples
+        -----------
+        >>> normalizer = PrecisionOncologyNormalizer().fit(["Avastin", "Bevacizumab"], ["CHEMBL1201583"] * 2)
+        >>> normalizer.names["avastin"]
+        ['CHEMBL1201583']
+        '''
+        return _NameIds(self)
 
     def _transform_name(self, name):
         name = name.lower()
@@ -30,19 +180,527 @@ class PrecisionOncologyNormalizer:
         return name
 
     def fit(self, names, name_ids):
-        self.names = dict()
+        self.sources = None
+        return self._fit_keys(map(self._transform_name, names), name_ids)
+
+    def fit_vocabularies(self, vocabularies):
+        '''
+        Fits the names and ids of multiple vocabularies (id namespaces) into one shared index, so
+        that every name is stored, indexed and matched once. The ids of a name are tagged with
+        their source and a query returns the ids of all vocabularies (as strings), grouped by source.
+
+        Parameters
+        -----------
+        :param vocabularies: a dictionary from source names to tupels of names with associated ids
+        (e.g. as returned by load_ebi_drugs)
+        :return: the fitted normalizer
+
+        Raises
+        ------
+        ValueError
+            If a source name contains the source separator.
+
+        Examples
+        -----------
+        >>> vocabularies = {"chembl": load_ebi_drugs(), "drugbank": load_drugbank_drugs()}
+        >>> normalizer = PrecisionOncologyNormalizer().fit_vocabularies(vocabularies)
+        >>> normalizer.query("Avastin")
+        (['avastin'], [{'chembl': ['CHEMBL1201583'], 'drugbank': ['DB00112']}], {'match_type': 'exact'})
+        '''
+        self.sources = []
+        keys, name_ids = [], []
+
+        for source, (names, source_ids) in vocabularies.items():
+            pairs = list(zip(names, source_ids))
+            keys.extend(self._transform_name(name) for name, _ in pairs)
+            name_ids.extend(self._get_source_ids([name_id for _, name_id in pairs], source))
+
+        return self._fit_keys(keys, name_ids)
+
+    def _get_source_ids(self, name_ids, source):
+        if self.sources is None:
+            if source is not None: raise ValueError("Sources are only supported after fit_vocabularies.")
+            return name_ids
 
+        if source is None:
+            raise ValueError("The source of the ids is required for normalizers with multiple vocabularies.")
+
+        if SOURCE_SEPARATOR in source:
+            raise ValueError("Source names must not contain the source separator.")
+
+        if source not in self.sources: self.sources.append(source)
+        return [f"{source}{SOURCE_SEPARATOR}{name_id}" for name_id in name_ids]
+
+    def _fit_keys(self, names, name_ids):
+        keys, ids = dict(), dict()
+        key_rows, id_rows = [], []
+
+        # intern names and ids
         for name, name_id in zip(names, name_ids):
-            name = self._transform_name(name)
+            if name not in keys: keys[name] = len(keys)
+            if name_id not in ids: ids[name_id] = len(ids)
+
+            key_rows.append(keys[name])
+            id_rows.append(ids[name_id])
+
+        # store names sorted by length as concatenated codes, so that every length is a contiguous block of rows
+        self._keys = np.array(sorted(keys, key=len), dtype=object)
+        self._rows = {key: row for row, key in enumerate(self._keys.tolist())}
+        self._name_codes, self._name_lengths, self._alphabet = encode_names(self._keys.tolist())
+
+        # sort the id table, so that sorted postings materialize ids in sorted order
+        id_table = list(ids)
+        id_order = sorted(range(len(id_table)), key=id_table.__getitem__)
+        self._id_table = [id_table[idx] for idx in id_order]
+
+        key_map = np.array([self._rows[key] for key in keys], dtype=np.int64)
+        id_map = np.empty(len(id_table), dtype=np.int64)
+        id_map[id_order] = np.arange(len(id_table))
 
-            if name not in self.names: self.names[name] = list()
-            self.names[name].append(name_id)
+        self._posting_offsets, self._postings = _build_postings(key_map[np.array(key_rows, dtype=np.int64)],
+                                                                id_map[np.array(id_rows, dtype=np.int64)],
+                                                                len(keys), len(id_table))
+
+        self._build_indexes()
+
+        if self._query_cache is not None:
+            self._query_cache.clear()
 
         return self
 
+    def _build_indexes(self, bk_tree=None, symspell_index=None, qgram_index=None, substring_trie=None):
+        lengths, starts = np.unique(self._name_lengths, return_index=True)
+        stops = np.append(starts[1:], self._name_lengths.shape[0])
+        self._length_buckets = {length: (start, stop) for length, start, stop in zip(lengths.tolist(), starts, stops)}
+        self._name_offsets = name_offsets(self._name_lengths)
+
+        if self.engine == "bktree":
+            self._bk_tree = BKTree(self._rows) if bk_tree is None else bk_tree
+
+        if self.engine == "symspell":
+            if symspell_index is None:
+                symspell_index = SymSpellIndex(self._rows, max_edit_distance=self.max_edit_distance)
+
+            self._symspell_index = symspell_index
+
+        if self.engine == "qgram":
+            self._qgram_index = QGramIndex(self._keys.tolist()) if qgram_index is None else qgram_index
+
+        # the substring trie is built with the other indexes (and stored in snapshots), so that neither
+        # the first query nor forked workers have to build it
+        if substring_trie is None:
+            substring_trie = PrefixTrie(self._name_codes, self._name_lengths, self._alphabet)
+
+        self._substring_trie = substring_trie
+
+        # incremental updates: removed rows are marked, added names are kept in a small delta segment
+        # and rows with changed ids keep their sorted ids aside, until all of them are merged by _compact
+        self._removed = np.zeros(len(self._keys), dtype=bool)
+        self._n_removed = 0
+        self._delta_keys = []
+        self._delta_postings = dict()
+        self._delta_codes, self._delta_lengths, self._delta_alphabet = encode_names(self._delta_keys)
+        self._delta_trie = PrefixTrie(self._delta_codes, self._delta_lengths, self._delta_alphabet)
+        self._max_key_length = int(max(self._name_lengths.max(initial=0), self._delta_lengths.max(initial=0)))
+
+        # names without any mapped id must not match, as if the id mapping had been applied at fit time
+        self._unmapped = np.zeros(len(self._keys), dtype=bool)
+
+        if self.id_mapping is not None:
+            mapped = np.array([self._has_mapped_ids([name_id]) for name_id in self._id_table], dtype=bool)
+            n_mapped = np.concatenate([[0], np.cumsum(mapped[self._postings], dtype=np.int64)])
+            self._unmapped = n_mapped[self._posting_offsets[1:]] == n_mapped[self._posting_offsets[:-1]]
+
+        self._update_unmapped()
+
+    def partial_fit(self, names, name_ids, source=None):
+        '''
+        Adds names and ids to the reference data of a fitted normalizer. Only the added names are
+        encoded and indexed, so the cost grows with the number of added names instead of the size
+        of the reference data.
+
+        Parameters
+        -----------
+        :param names: a list of names
+        :param name_ids: a list of ids, one for every name
+        :param source: the source of the ids (required for normalizers with multiple vocabularies)
+        :return: the updated normalizer
+
+        Raises
+        ------
+        ValueError
+            If the source is missing for a normalizer with multiple vocabularies (or given for one without).
+
+        Examples
+        -----------
+        >>> normalizer = PrecisionOncologyNormalizer().fit(drug_names, chembl_ids)
+        >>> normalizer.partial_fit(["Avastin"], ["CHEMBL1201583"])
+        '''
+        if not hasattr(self, "names"):
+            return self.fit(names, name_ids) if source is None else self.fit_vocabularies({source: (names, name_ids)})
+
+        n_rows = len(self._keys)
+        name_ids = self._get_source_ids(name_ids, source)
+
+        for name, name_id in zip(names, name_ids):
+            key = self._transform_name(name)
+
+            if key not in self._rows:
+                self._rows[key] = n_rows + len(self._delta_keys)
+                self._delta_keys.append(key)
+                self._delta_postings[self._rows[key]] = []
+
+                if self.engine == "bktree": self._bk_tree.add(key)
+                if self.engine == "symspell": self._symspell_index.add(key)
+
+            row = self._rows[key]
+            if row not in self._delta_postings: self._delta_postings[row] = self._get_name_ids(key)
+
+            # keep the ids of a row sorted, as in the fitted postings
+            row_ids = self._delta_postings[row]
+            pos = bisect_left(row_ids, name_id)
+            if pos == len(row_ids) or row_ids[pos] != name_id: row_ids.insert(pos, name_id)
+
+        self._update_delta()
+        return self
+
+    def remove(self, names=None, name_ids=None, source=None):
+        '''
+        Removes names and/or ids from the reference data of a fitted normalizer. Names that lose all
+        of their ids are removed as well.
+
+        Parameters
+        -----------
+        :param names: a list of names to remove (with all of their ids)
+        :param name_ids: a list of ids to remove (from all names)
+        :param source: the source of the ids to remove (None removes them from all vocabularies)
+        :return: the updated normalizer
+
+        Examples
+        -----------
+        >>> normalizer = PrecisionOncologyNormalizer().fit(drug_names, chembl_ids)
+        >>> normalizer.remove(name_ids=["CHEMBL1201583"])
+        '''
+        n_rows = len(self._keys)
+        keys = set() if names is None else {key for key in map(self._transform_name, names) if key in self._rows}
+        name_ids = [] if name_ids is None else list(name_ids)
+
+        if self.sources is not None and source is None:
+            name_ids = {f"{tag}{SOURCE_SEPARATOR}{name_id}" for tag in self.sources for name_id in name_ids}
+        else:
+            name_ids = set(self._get_source_ids(name_ids, source))
+
+        # find the fitted rows whose postings reference removed ids, and all updated rows
+        ranks = [bisect_left(self._id_table, name_id) for name_id in name_ids]
+        ranks = [rank for rank, name_id in zip(ranks, name_ids)
+                 if rank < len(self._id_table) and self._id_table[rank] == name_id]
+
+        rows = set()
+
+        if len(name_ids) > 0:
+            positions = np.flatnonzero(np.isin(self._postings, ranks))
+            rows.update(np.searchsorted(self._posting_offsets, positions, side="right") - 1)
+            rows.update(row for row, row_ids in self._delta_postings.items() if not name_ids.isdisjoint(row_ids))
+
+        for row in map(int, rows):
+            if row < n_rows and self._removed[row]: continue
+
+            key = self._keys[row] if row < n_rows else self._delta_keys[row - n_rows]
+            row_ids = [name_id for name_id in self._get_name_ids(key) if name_id not in name_ids]
+
+            if len(row_ids) == 0:
+                keys.add(key)
+            else:
+                self._delta_postings[row] = row_ids
+
+        for key in keys:
+            row = self._rows.pop(key)
+            self._delta_postings.pop(row, None)
+
+            if row < n_rows:
+                self._removed[row] = True
+                self._n_removed += 1
+
+            # the BK-tree cannot delete nodes (nor a restored symspell index its stored variants),
+            # their search results are filtered instead
+            if self.engine == "symspell": self._symspell_index.remove(key)
+
+        # close the gaps of removed names in the delta segment
+        if any(key not in self._rows for key in self._delta_keys):
+            delta_keys = [key for key in self._delta_keys if key in self._rows]
+            delta_postings = {row: row_ids for row, row_ids in self._delta_postings.items() if row < n_rows}
+
+            for pos, key in enumerate(delta_keys):
+                delta_postings[n_rows + pos] = self._delta_postings[self._rows[key]]
+                self._rows[key] = n_rows + pos
+
+            self._delta_keys, self._delta_postings = delta_keys, delta_postings
+
+        self._update_delta()
+        return self
+
+    def _update_delta(self):
+        self._delta_codes, self._delta_lengths, self._delta_alphabet = encode_names(self._delta_keys)
+        self._delta_trie = PrefixTrie(self._delta_codes, self._delta_lengths, self._delta_alphabet)
+        self._max_key_length = int(max(self._name_lengths.max(initial=0), self._delta_lengths.max(initial=0)))
+        self._update_unmapped()
+
+        if self._query_cache is not None:
+            self._query_cache.clear()
+
+        # the delta postings hold the added names and the fitted names with changed ids
+        if len(self._delta_postings) + self._n_removed > max(COMPACTION_MIN_SIZE, COMPACTION_RATIO * len(self._keys)):
+            self._compact()
+
+    def _update_unmapped(self):
+        # rows with changed ids (and added names) may gain or lose their mapped ids
+        n_rows = len(self._keys)
+
+        if self.id_mapping is not None:
+            for row, row_ids in self._delta_postings.items():
+                if row < n_rows: self._unmapped[row] = not self._has_mapped_ids(row_ids)
+
+        self._delta_unmapped = np.array([self.id_mapping is not None and not self._has_mapped_ids(
+            self._delta_postings[n_rows + pos]) for pos in range(len(self._delta_keys))], dtype=bool)
+        self._n_unmapped = int(self._unmapped.sum() + self._delta_unmapped.sum())
+
+    def _can_match(self, name):
+        # removed names and names without mapped ids are treated as if they had not been fitted
+        if name not in self._rows: return False
+        if self._n_unmapped == 0: return True
+
+        row, n_rows = self._rows[name], len(self._keys)
+        return not (self._unmapped[row] if row < n_rows else self._delta_unmapped[row - n_rows])
+
+    def _has_updates(self):
+        return len(self._delta_keys) + self._n_removed + len(self._delta_postings) > 0
+
+    def _compact(self):
+        # merge all incremental updates by fitting the current (transformed) names and ids again
+        keys, name_ids = [], []
+
+        for key in self._rows:
+            for name_id in self._get_name_ids(key):
+                keys.append(key)
+                name_ids.append(name_id)
+
+        return self._fit_keys(keys, name_ids)
+
+    def save(self, file_path, resource_path=None):
+        '''
+        Stores the fitted normalizer as a compact, versioned binary snapshot that can be
+        memory-mapped by load. The substring trie and the index of the partial matching engine are
+        stored as well, so load does not compute anything. The id mapping is not stored, it can be
+        passed to load.
+
+        Parameters
+        -----------
+        :param file_path: the path of the snapshot file
+        :param resource_path: the resource file the reference data was loaded from; its fingerprint
+        is stored to detect stale snapshots
+
+        Raises
+        ------
+        ValueError
+            If the name ids are not strings.
+
+        Examples
+        -----------
+        >>> drug_names, chembl_ids = load_ebi_drugs()
+        >>> normalizer = PrecisionOncologyNormalizer().fit(drug_names, chembl_ids)
+        >>> normalizer.save("ebi_drugs.preon", resource_path="preon/resources/ebi_drugs.csv")
+        '''
+        if self._has_updates():
+            self._compact()
+
+        keys = self._keys.tolist()
+
+        if not all(isinstance(name_id, str) for name_id in self._id_table):
+            raise ValueError("Only normalizers with string ids can be stored as snapshots.")
+
+        key_data, key_offsets = encode_strings(keys)
+        id_data, id_offsets = encode_strings(self._id_table)
+        alphabet = np.array([ord(char) for char in sorted(self._alphabet, key=self._alphabet.get)], dtype=np.uint32)
+
+        arrays = {
+            "key_data": key_data, "key_offsets": key_offsets, "id_data": id_data, "id_offsets": id_offsets,
+            "postings": self._postings, "posting_offsets": self._posting_offsets, "name_codes": self._name_codes,
+            "name_lengths": self._name_lengths, "alphabet": alphabet
+        }
+
+        arrays["substring_trie_keys"] = self._substring_trie.keys
+        arrays["substring_trie_terminal"] = self._substring_trie.terminal
+
+        if self.engine == "bktree":
+            arrays["bk_tree_rows"], arrays["bk_tree_parents"], arrays["bk_tree_dists"] = self._bk_tree.to_arrays(
+                {key: row for row, key in enumerate(keys)})
+
+        if self.engine == "symspell":
+            arrays["symspell_hashes"], arrays["symspell_offsets"], arrays["symspell_rows"] = \
+                self._symspell_index.to_arrays({key: row for row, key in enumerate(keys)})
+
+        if self.engine == "qgram":
+            grams, arrays["qgram_offsets"], arrays["qgram_rows"], arrays["qgram_counts"] = self._qgram_index.to_arrays()
+            arrays["qgram_data"], arrays["qgram_data_offsets"] = encode_strings(grams)
+
+        meta_info = {
+            "enable_warnings": self.enable_warnings,
+            "engine": self.engine,
+            "max_edit_distance": self.max_edit_distance,
+            "cache_size": self.cache_size,
+            "sources": self.sources,
+            "fingerprint": None if resource_path is None else fingerprint(resource_path)
+        }
+
+        write_snapshot(file_path, arrays, meta_info)
+
+    @classmethod
+    def load(cls, file_path, mmap=True, resource_path=None, id_mapping=None):
+        '''
+        Loads a normalizer from a snapshot that was created with save.
+
+        Parameters
+        -----------
+        :param file_path: the path of the snapshot file
+        :param mmap: a flag to decide whether the name codes are memory-mapped instead of read into memory
+        :param resource_path: the resource file the snapshot should be up to date with
+        :param id_mapping: the id mapping that is applied to the ids of matched names at query time
+        :return: the fitted normalizer
+
+        Raises
+        ------
+        ValueError
+            If the snapshot does not match the fingerprint of the resource file.
+
+        Examples
+        -----------
+        >>> normalizer = PrecisionOncologyNormalizer.load("ebi_drugs.preon")
+        >>> normalizer.query("Avastin")
+        (['avastin'], [['CHEMBL1201583']], {'match_type': 'exact'})
+        '''
+        arrays, meta_info = read_snapshot(file_path, mmap=mmap)
+
+        if resource_path is not None and meta_info["fingerprint"] != fingerprint(resource_path):
+            raise ValueError(f"Snapshot {file_path} is stale, {resource_path} has changed since it was stored.")
+
+        normalizer = cls(enable_warnings=meta_info["enable_warnings"], engine=meta_info["engine"],
+                         max_edit_distance=meta_info["max_edit_distance"], cache_size=meta_info["cache_size"],
+                         id_mapping=id_mapping)
+
+        keys = decode_strings(arrays["key_data"], arrays["key_offsets"])
+        normalizer._rows = {key: row for row, key in enumerate(keys)}
+
+        normalizer._id_table = decode_strings(arrays["id_data"], arrays["id_offsets"])
+        normalizer.sources = meta_info.get("sources", None)
+        normalizer._postings, normalizer._posting_offsets = arrays["postings"], arrays["posting_offsets"]
+
+        normalizer._keys = np.array(keys, dtype=object)
+        normalizer._name_codes, normalizer._name_lengths = arrays["name_codes"], arrays["name_lengths"]
+        normalizer._alphabet = {chr(char): code for code, char in enumerate(arrays["alphabet"].tolist())}
+
+        bk_tree, symspell_index, qgram_index = None, None, None
+
+        if normalizer.engine == "bktree":
+            bk_tree = BKTree.from_arrays(keys, arrays["bk_tree_rows"], arrays["bk_tree_parents"],
+                                         arrays["bk_tree_dists"])
+
+        if normalizer.engine == "symspell":
+            symspell_index = SymSpellIndex.from_arrays(keys, arrays["symspell_hashes"], arrays["symspell_offsets"],
+                                                       arrays["symspell_rows"], normalizer.max_edit_distance)
+
+        if normalizer.engine == "qgram":
+            grams = decode_strings(arrays["qgram_data"], arrays["qgram_data_offsets"])
+            qgram_index = QGramIndex.from_arrays(keys, grams, arrays["qgram_offsets"], arrays["qgram_rows"],
+                                                 arrays["qgram_counts"])
+
+        substring_trie = PrefixTrie.from_arrays(arrays["substring_trie_keys"], arrays["substring_trie_terminal"],
+                                                normalizer._alphabet)
+
+        normalizer._build_indexes(bk_tree=bk_tree, symspell_index=symspell_index, qgram_index=qgram_index,
+                                  substring_trie=substring_trie)
+        return normalizer
+
+    def _get_partial_lengths(self, query_length, threshold, n_decimals):
+        lengths = np.array(list(self._length_buckets), dtype=np.int64)
+        radii = max_edit_distances(query_length, lengths, threshold, n_decimals)
+
+        # the edit distance is bounded from below by the length difference,
+        # so we only need to visit length buckets that can still beat the threshold
+        feasible = radii >= np.abs(lengths - query_length)
+
+        return lengths[feasible], radii[feasible]
+
+    def _get_partial_candidates(self, query_name, threshold, n_decimals):
+        lengths, radii = self._get_partial_lengths(len(query_name), threshold, n_decimals)
+
+        # names added since fitting are not in the q-gram index, they are verified directly
+        if self.engine == "qgram":
+            candidates = self._qgram_index.search(query_name, dict(zip(lengths.tolist(), radii.tolist())))
+            candidates = [candidate for candidate in candidates + self._delta_keys if self._can_match(candidate)]
+            distances = [jellyfish.levenshtein_distance(query_name, candidate) for candidate in candidates]
+
+            return candidates, distances, len(candidates)
+
+        delta_radii = max_edit_distances(len(query_name), self._delta_lengths, threshold, n_decimals)
+        delta_radii = delta_radii[delta_radii >= np.abs(self._delta_lengths - len(query_name))]
+
+        radius = max(radii.max(initial=-1), delta_radii.max(initial=-1))
+
+        # the indexes verify their candidates, so their distances are reused
+        if self.engine == "bktree":
+            candidates, distances, n_computations = self._bk_tree.search(query_name, radius)
+        else:
+            candidates, distances, n_computations = self._symspell_index.search(query_name, radius)
+
+        matches = [(candidate, dist) for candidate, dist in zip(candidates, distances) if self._can_match(candidate)]
+        return [candidate for candidate, _ in matches], [dist for _, dist in matches], n_computations
+
+    def _get_name_ids(self, name):
+        row = self._rows[name]
+        if row in self._delta_postings: return list(self._delta_postings[row])
+
+        postings = self._postings[self._posting_offsets[row]:self._posting_offsets[row + 1]]
+        return [self._id_table[posting] for posting in postings.tolist()]
+
+    def _expand_ids(self, name_ids):
+        if hasattr(self.id_mapping, "expand"):
+            mapped_ids = {mapped_id for name_id in name_ids for mapped_id in self.id_mapping.expand(name_id)}
+        else:
+            mapped_ids = {mapped_id for name_id in name_ids for mapped_id in self.id_mapping.get(name_id, ())}
+
+        return sorted(mapped_ids)
+
+    def _has_mapped_ids(self, name_ids):
+        if self.sources is not None:
+            name_ids = [name_id.partition(SOURCE_SEPARATOR)[2] for name_id in name_ids]
+
+        return len(self._expand_ids(name_ids)) > 0
+
+    def _group_ids(self, name_ids):
+        # the ids of a name are sorted by source and id, so every group stays sorted
+        grouped = dict()
+
+        for name_id in name_ids:
+            source, _, name_id = name_id.partition(SOURCE_SEPARATOR)
+            grouped.setdefault(source, []).append(name_id)
+
+        # sources without mapped ids are dropped, as their names would not be fitted
+        if self.id_mapping is not None:
+            grouped = {source: self._expand_ids(ids) for source, ids in grouped.items()}
+            grouped = {source: ids for source, ids in grouped.items() if len(ids) > 0}
+
+        return grouped
+
     def _get_query_result(self, found_names, meta_info):
         found_names = np.unique(found_names).tolist()
-        name_ids = [np.unique(self.names[found_name]).tolist() for found_name in found_names]
+        name_ids = [self._get_name_ids(found_name) for found_name in found_names]
+
+        # ids of multiple vocabularies are grouped by source, the id mapping is only applied to matched names
+        if self.sources is not None:
+            name_ids = [self._group_ids(ids) for ids in name_ids]
+        elif self.id_mapping is not None:
+            name_ids = [self._expand_ids(ids) for ids in name_ids]
+
         return found_names, name_ids, meta_info
 
     def _get_empty_result(self, query_name):
@@ -52,94 +710,416 @@ class PrecisionOncologyNormalizer:
 
         return None
 
-    def query(self, query_name, match_type="all", threshold=.2, n_grams=1, n_decimals=3):
-        _query_name = self._transform_name(query_name)
-        meta_info = dict()
+    def _get_partial_result(self, query_name, names, distances, threshold, n_decimals):
+        if len(names) == 0:
+            return self._get_empty_result(query_name)
+
+        if n_decimals is not None:
+            distances = np.round(distances, n_decimals)
+
+        min_dist = np.min(distances)
+
+        if min_dist > threshold:
+            return self._get_empty_result(query_name)
 
+        meta_info = {"match_type": "partial", "edit_distance": min_dist}
+        names_idx = np.isin(distances, min_dist)
+        names = np.array(names)
+
+        return self._get_query_result(names[names_idx].tolist(), meta_info)
+
+    def _query_trivial(self, query_name, _query_name, match_type, n_grams, record=None):
         if match_type in ("exact", "all"):
             # try to find the trivial match
-            meta_info["match_type"] = "exact"
+            if record is not None: start = time.perf_counter()
+            found = self._can_match(_query_name)
+            res = self._get_query_result([_query_name], {"match_type": "exact"}) if found else None
+            if record is not None: record["stages"]["exact"] = time.perf_counter() - start
 
-            if _query_name in self.names:
-                return self._get_query_result([_query_name], meta_info)
+            if res is not None:
+                return res
 
         if match_type in ("substring", "all"):
             # try to find trivial substring match
-            meta_info["match_type"] = "substring"
+            if record is not None: start = time.perf_counter()
+
+            tokens = [self._transform_name(token) for token in query_name.split(" ")]
+            matches = self._get_substring_matches(tokens, n_grams)
+            res = self._get_query_result(matches, {"match_type": "substring"}) if len(matches) > 0 else None
 
-            substrings = query_name.split(" ")
+            if record is not None: record["stages"]["substring"] = time.perf_counter() - start
 
-            for i_gram in range(2, n_grams + 1):
-                grams = ngrams(substrings, i_gram)
-                grams = [" ".join(gram) for gram in grams]
-                substrings.extend(grams)
+            if res is not None:
+                return res
 
+        return None
+
+    def _get_substring_matches(self, tokens, n_grams):
+        n_grams = max(n_grams, 1)
+
+        # an n-gram is only probed while it is not longer than the longest name, so it spans about as many
+        # tokens as the longest name; unless there are many of them (e.g. a long text of short tokens with a
+        # large n_grams), probing is cheaper than a walk through the tries
+        n_chars = sum(len(token) for token in tokens)
+        n_spanned = min(n_grams, len(tokens), self._max_key_length * len(tokens) // max(n_chars, 1) + 1)
+
+        if len(tokens) * n_spanned <= SUBSTRING_PROBE_LIMIT:
             matches = []
 
-            for token in substrings:
-                _token = self._transform_name(token)
+            for start in range(len(tokens)):
+                gram = ""
 
-                if len(_token) == 0: continue
-                if _token in self.names: matches.append(_token)
+                for token in tokens[start:start + n_grams]:
+                    gram += token
+                    if len(gram) > self._max_key_length: break
+                    if len(gram) > 0 and self._can_match(gram): matches.append(gram)
 
-            if len(matches) > 0:
-                return self._get_query_result(matches, meta_info)
+            return matches
 
-        if match_type in ("partial", "all"):
-            # otherwise, try partial matching
-            meta_info["match_type"] = "partial"
-            names = list(self.names)
+        # a name matches if it spans up to n_grams consecutive tokens, so it has to start at the start of
+        # a token and end at the end of a token; the walk from a token start stops at the end of its n-gram,
+        # counted from the latest token that starts there
+        offsets = np.cumsum([0] + [len(token) for token in tokens]).tolist()
+        starts = dict(zip(offsets[:-1], range(len(tokens))))
+        stops = [offsets[min(idx + n_grams, len(tokens))] for idx in starts.values()]
+        text, ends, matches = "".join(tokens), set(offsets[1:]), []
 
-            distances = []
+        for trie in (self._substring_trie, self._delta_trie):
+            for start, stop in trie.search(text, list(starts), stops=stops):
+                if stop in ends: matches.append(text[start:stop])
 
-            # calculate distances for query string
-            for name in names:
-                dist = jellyfish.levenshtein_distance(_query_name, name) / max(len(_query_name), len(name))
-                distances.append(dist)
+        return [match for match in matches if self._can_match(match)]
 
-            if n_decimals is not None:
-                distances = np.round(distances, n_decimals)
+    def _query_partial(self, query_name, _query_name, threshold, n_decimals, record=None):
+        names, dists, n_computations = self._get_partial_candidates(_query_name, threshold, n_decimals)
 
-            min_dist = np.min(distances)
+        if record is not None:
+            record["candidates"] += len(names)
+            record["distance_computations"] += n_computations
 
-            if min_dist > threshold:
-                return self._get_empty_result(query_name)
+        # normalize the edit distances of the candidates
+        distances = [dist / max(len(_query_name), len(name)) for name, dist in zip(names, dists)]
+        return self._get_partial_result(query_name, names, distances, threshold, n_decimals)
 
-            meta_info["edit_distance"] = min_dist
-            names_idx = np.isin(distances, min_dist)
-            names = np.array(names)
+    def _query_partial_batch(self, query_names, _query_names, threshold, n_decimals, records=None):
+        # queries of equal length visit the same rows, so they are scored together with the batch kernel
+        groups = dict()
 
-            return self._get_query_result(names[names_idx].tolist(), meta_info)
+        for idx, _query_name in enumerate(_query_names):
+            if len(_query_name) not in groups: groups[len(_query_name)] = list()
+            groups[len(_query_name)].append(idx)
 
-        return self._get_empty_result(query_name)
+        results = [None] * len(query_names)
 
-    def transform(self, names, verbose=0, **query_args):
-        df = []
+        for query_length, group in groups.items():
+            queries = [_query_names[idx] for idx in group]
+            candidates = [([], []) for _ in group]
+            best = np.full(len(group), np.inf)
+
+            def collect(active, keys, distances, rounded):
+                for idx, dists, rounded_dists in zip(active, distances, rounded):
+                    best[idx] = min(best[idx], rounded_dists.min(initial=np.inf))
+
+                    rows = np.flatnonzero(rounded_dists <= threshold)
+                    candidates[idx][0].extend(keys[row] for row in rows)
+                    candidates[idx][1].extend(dists[rows])
+
+            # visit length buckets from the closest to the farthest length, so that good matches are found
+            # early and the distance bound (a band around the diagonal) tightens for the remaining buckets
+            lengths, _ = self._get_partial_lengths(query_length, threshold, n_decimals)
+            lengths = lengths[np.lexsort((lengths, np.abs(lengths - query_length)))]
+
+            if records is not None:
+                n_candidates = sum(self._length_buckets[length][1] - self._length_buckets[length][0]
+                                   for length in lengths) + len(self._delta_keys)
+
+                for idx in group:
+                    records[idx]["candidates"] += n_candidates
+
+            for length in lengths:
+                max_dists = max_edit_distances(query_length, np.full(len(group), length),
+                                               np.minimum(best, threshold), n_decimals)
+                active = np.flatnonzero(max_dists >= abs(length - query_length))
+
+                if active.shape[0] == 0: continue
+
+                start, stop = self._length_buckets[length]
+
+                if records is not None:
+                    for idx in active: records[group[idx]]["distance_computations"] += stop - start
+
+                distances = levenshtein_distances([queries[idx] for idx in active],
+                                                  self._name_codes[self._name_offsets[start]:self._name_offsets[stop]],
+                                                  self._name_lengths[start:stop], self._alphabet,
+                                                  max_dists=max_dists[active])
+                distances = distances / max(length, query_length, 1)
+                rounded = distances if n_decimals is None else np.round(distances, n_decimals)
 
-        for name in tqdm(names, disable=verbose < 1):
+                # removed names (and names without mapped ids) must neither match nor tighten the bound
+                if self._n_removed > 0 or self._n_unmapped > 0:
+                    rounded = np.where(self._removed[start:stop] | self._unmapped[start:stop], np.inf, rounded)
+
+                collect(active, self._keys[start:stop], distances, rounded)
+
+            # names added since fitting are scanned at once, with the loosest bound over their lengths
+            if len(self._delta_keys) > 0:
+                max_dists = np.array([max_edit_distances(query_length, self._delta_lengths, bound, n_decimals).max()
+                                      for bound in np.minimum(best, threshold)])
+
+                if records is not None:
+                    for idx in group: records[idx]["distance_computations"] += len(self._delta_keys)
+
+                distances = levenshtein_distances(queries, self._delta_codes, self._delta_lengths,
+                                                  self._delta_alphabet, max_dists=max_dists)
+                distances = distances / np.maximum(np.maximum(self._delta_lengths, query_length), 1)
+                rounded = distances if n_decimals is None else np.round(distances, n_decimals)
+                rounded = np.where(self._delta_unmapped, np.inf, rounded)
+
+                collect(range(len(group)), self._delta_keys, distances, rounded)
+
+            for idx, (names, distances) in zip(group, candidates):
+                results[idx] = self._get_partial_result(query_names[idx], names, distances, threshold, n_decimals)
+
+        return results
+
+    def _get_query_key(self, query_name):
+        # queries with the same normalized tokens have the same result (the substring
+        # stage depends on the tokens, so the key keeps them apart)
+        return tuple(self._transform_name(token) for token in query_name.split(" "))
+
+    def cache_info(self):
+        '''
+        Returns statistics about the query cache.
+
+        :return: a dictionary with the number of hits, misses, cached entries and the maximum size
+        (None if caching is disabled)
+
+        Examples
+        -----------
+        >>> normalizer = PrecisionOncologyNormalizer(cache_size=10000).fit(drug_names, chembl_ids)
+        >>> normalizer.query("Avastin")
+        >>> normalizer.cache_info()
+        {'hits': 0, 'misses': 1, 'size': 1, 'max_size': 10000}
+        '''
+        if self._query_cache is None:
+            return None
+
+        return self._query_cache.info()
+
+    def _query_batch(self, query_names, **query_args):
+        # resolve every distinct query once and broadcast its result to all duplicates
+        groups = dict()
+
+        for idx, query_name in enumerate(query_names):
+            key = self._get_query_key(query_name)
+            if key not in groups: groups[key] = list()
+            groups[key].append(idx)
+
+        distinct_results, distinct_times = self._query_distinct([query_names[rows[0]] for rows in groups.values()],
+                                                                list(groups), **query_args)
+
+        results, query_times = [None] * len(query_names), [0.] * len(query_names)
+
+        for rows, res, query_time in zip(groups.values(), distinct_results, distinct_times):
+            results[rows[0]] = res
+
+            for idx in rows[1:]:
+                results[idx] = _copy_result(res) if res is not None else self._get_empty_result(query_names[idx])
+
+            for idx in rows:
+                query_times[idx] = query_time / len(rows)
+
+        return results, query_times
+
+    def _query_distinct(self, query_names, query_keys, match_type="all", threshold=.2, n_grams=1, n_decimals=3):
+        results, query_times = [None] * len(query_names), [0.] * len(query_names)
+        cache_keys, partial = dict(), []
+
+        # instrumentation only runs if a metrics callback is set
+        records = None if self.metrics is None else [_new_record(query_name) for query_name in query_names]
+
+        if records is None:
+            _query_names = [self._transform_name(query_name) for query_name in query_names]
+        else:
+            _query_names = []
+
+            for query_name, record in zip(query_names, records):
+                start = time.perf_counter()
+                _query_names.append(self._transform_name(query_name))
+                record["stages"]["normalize"] = time.perf_counter() - start
+
+        for idx, (query_name, _query_name) in enumerate(zip(query_names, _query_names)):
             query_time = time.process_time()
-            res = self.query(name, **query_args)
-            query_time = time.process_time() - query_time
 
+            if self._query_cache is not None:
+                key = query_keys[idx], match_type, threshold, n_grams, n_decimals
+                hit, res = self._query_cache.get(key)
+
+                if hit:
+                    results[idx] = _copy_result(res) if res is not None else self._get_empty_result(query_name)
+                    query_times[idx] = time.process_time() - query_time
+                    if records is not None: records[idx]["cache_hit"] = True
+                    continue
+
+                cache_keys[idx] = key
+
+            results[idx] = self._query_trivial(query_name, _query_name, match_type, n_grams,
+                                               record=None if records is None else records[idx])
+
+            if results[idx] is None:
+                if match_type in ("partial", "all"):
+                    partial.append(idx)
+                else:
+                    results[idx] = self._get_empty_result(query_name)
+
+            query_times[idx] = time.process_time() - query_time
+
+        if len(partial) > 0:
+            query_time, start = time.process_time(), time.perf_counter()
+            partial_records = None if records is None else [records[idx] for idx in partial]
+
+            if self.engine == "scan":
+                partial_results = self._query_partial_batch([query_names[idx] for idx in partial],
+                                                            [_query_names[idx] for idx in partial], threshold,
+                                                            n_decimals, records=partial_records)
+            else:
+                partial_results = [self._query_partial(query_names[idx], _query_names[idx], threshold, n_decimals,
+                                                       record=None if records is None else records[idx])
+                                   for idx in partial]
+
+            # the partial stage runs for all queries at once, so its time is shared among them
+            query_time = (time.process_time() - query_time) / len(partial)
+            wall_time = (time.perf_counter() - start) / len(partial)
+
+            for idx, res in zip(partial, partial_results):
+                results[idx] = res
+                query_times[idx] += query_time
+                if records is not None: records[idx]["stages"]["partial"] = wall_time
+
+        for idx, key in cache_keys.items():
+            self._query_cache.put(key, _copy_result(results[idx]))
+
+        if records is not None:
+            for record, res in zip(records, results):
+                if res is not None: record["match_type"] = res[2]["match_type"]
+                record["time"] = sum(record["stages"].values())
+                self.metrics(record)
+
+        return results, query_times
+
+    def query(self, query_name, match_type="all", threshold=.2, n_grams=1, n_decimals=3):
+        results, _ = self._query_batch([query_name], match_type=match_type, threshold=threshold, n_grams=n_grams,
+                                       n_decimals=n_decimals)
+        return results[0]
+
+    def _query_batches(self, batches, n_jobs, query_args):
+        if n_jobs == 1:
+            for batch in batches:
+                yield self._query_batch(batch, **query_args)
+
+            return
+
+        import multiprocessing
+
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+
+        # forked workers inherit the fitted normalizer (and its read-only arrays) instead of receiving pickled copies
+        if "fork" in multiprocessing.get_all_start_methods():
+            context, initializer, initargs = multiprocessing.get_context("fork"), None, ()
+            _init_worker(self)
+        else:
+            context, initializer, initargs = multiprocessing.get_context(), _init_worker, (self,)
+
+        try:
+            with context.Pool(n_jobs, initializer=initializer, initargs=initargs) as pool:
+                # imap returns the batch results in input order
+                collect = self.metrics is not None
+
+                for result, records in pool.imap(_query_batch_worker, [(batch, query_args, collect) for batch in batches]):
+                    for record in records or ():
+                        self.metrics(record)
+
+                    yield result
+        finally:
+            _init_worker(None)
+
+    def _get_records(self, names, results, query_times):
+        records = []
+
+        for name, res, query_time in zip(names, results, query_times):
             if res is None:
-                df.append((name, [], [[None]], "none", None, query_time))
+                records.append((name, [], [[None]], "none", None, query_time))
                 continue
 
             found_names, found_ids, meta_info = res
-            df.append((name, found_names, found_ids, meta_info["match_type"], meta_info.get("edit_distance", None),
-                       query_time))
+            records.append((name, found_names, found_ids, meta_info["match_type"], meta_info.get("edit_distance", None),
+                            query_time))
+
+        return records
+
+    def transform(self, names, verbose=0, batch_size=1024, n_jobs=1, **query_args):
+        # pandas and tqdm are only imported for batch transformations, so that importing preon stays fast
+        import pandas as pd
+        from tqdm import tqdm
+
+        names = list(names)
+        batches = [names[start:start + batch_size] for start in range(0, len(names), batch_size)]
+        df = []
+
+        with tqdm(total=len(names), disable=verbose < 1) as progress:
+            for batch, (results, query_times) in zip(batches, self._query_batches(batches, n_jobs, query_args)):
+                df.extend(self._get_records(batch, results, query_times))
+                progress.update(len(batch))
 
-        df = pd.DataFrame.from_records(df,
-                                       columns=["Name", "Found Names", "Found Name IDs", "Match Type", "Edit Distance",
-                                                "Query Time"])
+        df = pd.DataFrame.from_records(df, columns=TRANSFORM_COLUMNS)
         return df
 
-    def evaluate(self, X, y, verbose=0, **query_args):
-        df = self.transform(X, verbose=verbose, **query_args)
+    def transform_iter(self, names, chunk_size=1024, as_records=False, verbose=0, **query_args):
+        '''
+        Normalizes names from any iterable (e.g. a file or a database cursor) chunk by chunk. Only
+        one chunk is held in memory at a time and results are available as soon as a chunk is done.
+
+        Parameters
+        -----------
+        :param names: an iterable of names (it is consumed lazily)
+        :param chunk_size: the number of names that are normalized and returned together
+        :param as_records: a flag to decide whether chunks are returned as lists of dictionaries instead of data frames
+        :param verbose: a flag to show a progress bar
+        :param query_args: the arguments passed to the query method
+        :return: a generator of data frames (or lists of records) with the same columns as transform
+
+        Examples
+        -----------
+        >>> with open("treatments.txt") as file:
+        >>>     for df_chunk in normalizer.transform_iter(line.strip() for line in file):
+        >>>         df_chunk.to_csv("normalized.csv", mode="a", header=False)
+        '''
+        import pandas as pd
+        from tqdm import tqdm
+
+        names = iter(names)
+
+        with tqdm(disable=verbose < 1) as progress:
+            while True:
+                batch = list(islice(names, chunk_size))
+                if len(batch) == 0: break
+
+                results, query_times = self._query_batch(batch, **query_args)
+                records = self._get_records(batch, results, query_times)
+                progress.update(len(batch))
+
+                if as_records:
+                    yield [dict(zip(TRANSFORM_COLUMNS, record)) for record in records]
+                else:
+                    yield pd.DataFrame.from_records(records, columns=TRANSFORM_COLUMNS)
+
+    def evaluate(self, X, y, verbose=0, n_jobs=1, **query_args):
+        df = self.transform(X, verbose=verbose, n_jobs=n_jobs, **query_args)
         df["Name IDs"] = y
 
-        # helper procedure
-        flatten = lambda data: [item for sub in data for item in sub]
+        # helper procedure (ids of multiple vocabularies are grouped by source)
+        flatten = lambda data: [item for sub in data for item in
+                                (sum(sub.values(), []) if isinstance(sub, dict) else sub)]
 
         correct_matches = []
         for name_ids, found_ids in zip(y, df["Found Name IDs"].tolist()):
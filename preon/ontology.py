@@ -0,0 +1,370 @@
+import collections
+import os
+from bisect import bisect_left
+
+import numpy as np
+
+from preon.snapshot import decode_strings, encode_strings, fingerprint, read_snapshot, write_snapshot
+
+CACHE_SUFFIX = ".preon"
+
+# parsed ontologies of this process, by file path and fingerprint
+_ontologies = dict()
+
+
+class HierarchyIndex:
+    '''
+    A reachability index of a hierarchy (a directed acyclic graph of subclass relations), that
+    stores the sparse transitive closure in CSR format, so that the descendants and ancestors of
+    a term are array lookups instead of graph traversals. Hierarchies that are given by MeSH
+    tree numbers are indexed with interval labels: sorted tree numbers place every subtree
+    into one contiguous range.
+
+    Parameters
+    -----------
+    :param ids: a list of term ids
+    :param edges: a list of (subclass id, superclass id) tupels
+
+    Raises
+    ------
+    ValueError
+        If the hierarchy contains a cycle.
+
+    Examples
+    -----------
+    >>> index = HierarchyIndex(["DOID:162", "DOID:305"], [("DOID:305", "DOID:162")])
+    >>> index.descendants("DOID:162")
+    ['DOID:162', 'DOID:305']
+    '''
+
+    def __init__(self, ids, edges=()):
+        self.ids = np.array(ids, dtype=object)
+        self.rows = {term_id: row for row, term_id in enumerate(ids)}
+
+        if edges is not None:
+            self._set_descendants(self._get_closure(edges))
+
+    def _get_closure(self, edges):
+        n_terms = len(self.ids)
+        children, n_children = [[] for _ in range(n_terms)], np.zeros(n_terms, dtype=np.int64)
+        parents = [[] for _ in range(n_terms)]
+
+        for sub_id, super_id in set(edges):
+            if sub_id not in self.rows or super_id not in self.rows: continue
+
+            children[self.rows[super_id]].append(self.rows[sub_id])
+            parents[self.rows[sub_id]].append(self.rows[super_id])
+            n_children[self.rows[super_id]] += 1
+
+        # visit terms bottom-up (Kahn's algorithm), so that the closures of all children are known
+        closure = [None] * n_terms
+        queue = collections.deque(np.flatnonzero(n_children == 0).tolist())
+
+        while len(queue) > 0:
+            row = queue.popleft()
+            closure[row] = {row}.union(*(closure[child] for child in children[row]))
+
+            for parent in parents[row]:
+                n_children[parent] -= 1
+                if n_children[parent] == 0: queue.append(parent)
+
+        if any(rows is None for rows in closure):
+            raise ValueError("The hierarchy contains a cycle.")
+
+        return closure
+
+    def _set_descendants(self, closure):
+        self._desc_offsets = np.zeros(len(closure) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows in closure], out=self._desc_offsets[1:])
+        self._desc_rows = np.array([row for rows in closure for row in sorted(rows)], dtype=np.int32)
+
+        # the ancestor closure is the transposed descendant closure
+        terms = np.repeat(np.arange(len(closure)), np.diff(self._desc_offsets))
+        order = np.lexsort((terms, self._desc_rows))
+
+        self._anc_offsets = np.zeros(len(closure) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self._desc_rows, minlength=len(closure)), out=self._anc_offsets[1:])
+        self._anc_rows = terms[order].astype(np.int32)
+
+    @classmethod
+    def from_tree_numbers(cls, ids, tree_numbers):
+        '''
+        Creates the index of a hierarchy that is given by tree numbers (as in MeSH), where a
+        term is a descendant of another term if one of its tree numbers extends one of the
+        tree numbers of the other term (e.g. C04.588.033 extends C04.588).
+
+        Parameters
+        -----------
+        :param ids: a list of term ids
+        :param tree_numbers: a list of tree number lists, one for every id
+        :return: the hierarchy index
+        '''
+        index = cls(ids, edges=None)
+
+        entries = sorted((tree_number, row) for row, numbers in enumerate(tree_numbers) for tree_number in numbers)
+        sorted_numbers = [tree_number for tree_number, _ in entries]
+
+        # "." sorts directly before "/", so [t, t + "/") contains t and all tree numbers that extend it
+        closure = []
+
+        for row, numbers in enumerate(tree_numbers):
+            rows = {row}
+
+            for tree_number in numbers:
+                start, stop = bisect_left(sorted_numbers, tree_number), bisect_left(sorted_numbers, tree_number + "/")
+                rows.update(entry_row for _, entry_row in entries[start:stop])
+
+            closure.append(rows)
+
+        index._set_descendants(closure)
+        return index
+
+    def descendants(self, term_id):
+        '''
+        Finds the (transitive) descendants of a term, including the term itself.
+
+        Parameters
+        -----------
+        :param term_id: the term id
+        :return: a list of term ids
+        '''
+        row = self.rows[term_id]
+        return self.ids[self._desc_rows[self._desc_offsets[row]:self._desc_offsets[row + 1]]].tolist()
+
+    def ancestors(self, term_id):
+        '''
+        Finds the (transitive) ancestors of a term, including the term itself.
+
+        Parameters
+        -----------
+        :param term_id: the term id
+        :return: a list of term ids
+        '''
+        row = self.rows[term_id]
+        return self.ids[self._anc_rows[self._anc_offsets[row]:self._anc_offsets[row + 1]]].tolist()
+
+    def expand(self, term_id):
+        '''
+        Finds the related terms of a term, i.e. its descendants and ancestors. This allows to use
+        the index as the id mapping of a normalizer. Unknown terms are only related to themselves.
+
+        Parameters
+        -----------
+        :param term_id: the term id
+        :return: a list of term ids
+        '''
+        if term_id not in self.rows:
+            return [term_id]
+
+        return self.descendants(term_id) + self.ancestors(term_id)
+
+
+class Ontology:
+    '''
+    A compact view of an OBO ontology with the term names, EXACT synonyms and the subclass
+    hierarchy (is_a edges), which can be stored as a binary snapshot and loaded much faster
+    than parsing the OBO file again.
+
+    Parameters
+    -----------
+    :param ids: a list of term ids
+    :param names: a list of term names (None for terms without a name), one for every id
+    :param synonyms: a list of EXACT synonym lists, one for every id
+    :param edges: a list of (subclass id, superclass id) tupels
+
+    Examples
+    -----------
+    >>> ot = Ontology.from_obo("preon/resources/do.obo")
+    >>> ot.subclasses("DOID:162")
+    '''
+
+    def __init__(self, ids, names, synonyms, edges):
+        self.ids = list(ids)
+        self.names = dict(zip(self.ids, names))
+        self.synonyms = dict(zip(self.ids, synonyms))
+
+        self.parents = {term_id: set() for term_id in self.ids}
+        self.children = {term_id: set() for term_id in self.ids}
+
+        for sub_id, super_id in edges:
+            self.parents.setdefault(sub_id, set()).add(super_id)
+            self.children.setdefault(super_id, set()).add(sub_id)
+
+        self._hierarchy_index = None
+
+    @classmethod
+    def from_obo(cls, file_path):
+        '''
+        Parses an OBO file with pronto.
+
+        Parameters
+        -----------
+        :param file_path: the path of the OBO file
+        :return: the parsed ontology
+        '''
+        import pronto
+
+        ot = pronto.Ontology(file_path)
+        ids, names, synonyms, edges = [], [], [], []
+
+        for term in ot.terms():
+            ids.append(term.id)
+            names.append(term.name)
+            synonyms.append([synonym.description for synonym in term.synonyms if synonym.scope == "EXACT"])
+
+            for superclass in term.superclasses(distance=1, with_self=False):
+                edges.append((term.id, superclass.id))
+
+        return cls(ids, names, synonyms, edges)
+
+    def save(self, file_path, meta_info=None):
+        '''
+        Stores the ontology as a binary snapshot.
+
+        Parameters
+        -----------
+        :param file_path: the path of the snapshot file
+        :param meta_info: a JSON serializable dictionary of meta information to store alongside
+        '''
+        rows = {term_id: row for row, term_id in enumerate(self.ids)}
+        edges = [(rows[sub_id], rows[super_id]) for sub_id, super_ids in self.parents.items()
+                 for super_id in super_ids if sub_id in rows and super_id in rows]
+
+        synonym_offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum([len(self.synonyms[term_id]) for term_id in self.ids], out=synonym_offsets[1:])
+
+        arrays = dict()
+        arrays["id_data"], arrays["id_offsets"] = encode_strings(self.ids)
+        arrays["name_data"], arrays["name_offsets"] = encode_strings([self.names[term_id] or "" for term_id in self.ids])
+        arrays["has_name"] = np.array([self.names[term_id] is not None for term_id in self.ids], dtype=bool)
+        arrays["synonym_data"], arrays["synonym_string_offsets"] = encode_strings(
+            [synonym for term_id in self.ids for synonym in self.synonyms[term_id]])
+        arrays["synonym_offsets"] = synonym_offsets
+        arrays["edges"] = np.array(edges, dtype=np.int32).reshape(-1, 2)
+
+        write_snapshot(file_path, arrays, dict() if meta_info is None else meta_info)
+
+    @classmethod
+    def load(cls, file_path):
+        '''
+        Loads an ontology from a snapshot that was created with save.
+
+        Parameters
+        -----------
+        :param file_path: the path of the snapshot file
+        :return: a tupel of the ontology and the stored meta information
+        '''
+        arrays, meta_info = read_snapshot(file_path, mmap=False)
+
+        ids = decode_strings(arrays["id_data"], arrays["id_offsets"])
+        names = [name if has_name else None for name, has_name in
+                 zip(decode_strings(arrays["name_data"], arrays["name_offsets"]), arrays["has_name"].tolist())]
+
+        synonyms = decode_strings(arrays["synonym_data"], arrays["synonym_string_offsets"])
+        offsets = arrays["synonym_offsets"].tolist()
+        synonyms = [synonyms[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+        edges = [(ids[sub_row], ids[super_row]) for sub_row, super_row in arrays["edges"].tolist()]
+
+        return cls(ids, names, synonyms, edges), meta_info
+
+    def _lineage(self, term_id, neighbors, distance):
+        # breadth-first search over sorted neighbors (including the term itself), which
+        # yields the terms in the same order as pronto
+        max_distance = np.inf if distance is None else distance
+        linked, done = {term_id}, set()
+        frontier, terms = collections.deque([(term_id, 0)]), [term_id]
+
+        while len(frontier) > 0:
+            node, node_distance = frontier.popleft()
+            done.add(node)
+
+            if len(neighbors[node]) > 0 and node_distance < max_distance:
+                for neighbor in sorted(neighbors[node].difference(done)):
+                    frontier.append((neighbor, node_distance + 1))
+
+                for neighbor in sorted(neighbors[node].difference(linked)):
+                    linked.add(neighbor)
+                    terms.append(neighbor)
+
+        return terms
+
+    def hierarchy_index(self):
+        '''
+        Returns the reachability index of the subclass hierarchy (built on first use).
+
+        :return: the hierarchy index
+        '''
+        if self._hierarchy_index is None:
+            edges = [(sub_id, super_id) for sub_id, super_ids in self.parents.items() for super_id in super_ids]
+            self._hierarchy_index = HierarchyIndex(self.ids, edges)
+
+        return self._hierarchy_index
+
+    def subclasses(self, term_id, distance=None):
+        '''
+        Finds the (transitive) subclasses of a term, including the term itself.
+
+        Parameters
+        -----------
+        :param term_id: the term id
+        :param distance: the maximum number of is_a edges to follow (None for no limit)
+        :return: a list of term ids
+        '''
+        return self._lineage(term_id, self.children, distance)
+
+    def superclasses(self, term_id, distance=None):
+        '''
+        Finds the (transitive) superclasses of a term, including the term itself.
+
+        Parameters
+        -----------
+        :param term_id: the term id
+        :param distance: the maximum number of is_a edges to follow (None for no limit)
+        :return: a list of term ids
+        '''
+        return self._lineage(term_id, self.parents, distance)
+
+
+def load_ontology(file_path, cache_path=None):
+    '''
+    Loads an OBO ontology and parses it only once: the parsed ontology is kept for the process
+    and stored as a binary snapshot next to the OBO file, keyed by the fingerprint of the OBO
+    file, so that later runs skip parsing until the file changes.
+
+    Parameters
+    -----------
+    :param file_path: the path of the OBO file
+    :param cache_path: the path of the snapshot file (defaults to the OBO file path with a ".preon" suffix)
+    :return: the ontology
+
+    Examples
+    -----------
+    >>> ot = load_ontology("preon/resources/do.obo")
+    '''
+    cache_path = f"{file_path}{CACHE_SUFFIX}" if cache_path is None else cache_path
+    key = (os.path.abspath(file_path), fingerprint(file_path))
+
+    if key in _ontologies:
+        return _ontologies[key]
+
+    ot = None
+
+    if os.path.exists(cache_path):
+        try:
+            ot, meta_info = Ontology.load(cache_path)
+            if meta_info.get("fingerprint") != key[1]: ot = None
+        except (ValueError, KeyError, OSError):
+            ot = None
+
+    if ot is None:
+        ot = Ontology.from_obo(file_path)
+
+        # the cache is optional, e.g. if the resource folder is read-only
+        try:
+            ot.save(cache_path, meta_info={"fingerprint": key[1]})
+        except OSError:
+            pass
+
+    _ontologies[key] = ot
+    return ot
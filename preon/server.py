@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from preon.normalization import PrecisionOncologyNormalizer
+
+MATCH_TYPES = ("all", "exact", "substring", "partial")
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def _get_query_args(request):
+    query_args = dict()
+
+    if "match_type" in request:
+        if request["match_type"] not in MATCH_TYPES:
+            raise ValueError(f"match_type must be one of: {MATCH_TYPES}")
+
+        query_args["match_type"] = request["match_type"]
+
+    if "threshold" in request:
+        if isinstance(request["threshold"], bool) or not isinstance(request["threshold"], (int, float)):
+            raise ValueError("threshold must be a number")
+
+        query_args["threshold"] = request["threshold"]
+
+    if "n_grams" in request:
+        if isinstance(request["n_grams"], bool) or not isinstance(request["n_grams"], int):
+            raise ValueError("n_grams must be an integer")
+
+        query_args["n_grams"] = request["n_grams"]
+
+    if "n_decimals" in request:
+        if isinstance(request["n_decimals"], bool) or not isinstance(request["n_decimals"], (int, type(None))):
+            raise ValueError("n_decimals must be an integer or null")
+
+        query_args["n_decimals"] = request["n_decimals"]
+
+    return query_args
+
+
+def _to_json(name, res):
+    if res is None:
+        return {"name": name, "found_names": [], "found_name_ids": [], "match_type": "none", "edit_distance": None}
+
+    found_names, name_ids, meta_info = res
+    edit_distance = meta_info.get("edit_distance", None)
+
+    return {"name": name, "found_names": found_names, "found_name_ids": name_ids, "match_type": meta_info["match_type"],
+            "edit_distance": None if edit_distance is None else float(edit_distance)}
+
+
+class NormalizationServer:
+    '''
+    An asyncio HTTP/JSON server for a fitted normalizer. Concurrent requests are coalesced into
+    micro-batches for the batched query path, which runs in a single background thread, so that
+    the event loop keeps accepting requests while names are matched. Requests are rejected with
+    503 (backpressure) if too many names are pending, and with 413 if they contain more names
+    than can ever be pending.
+
+    Endpoints
+    -----------
+    POST /normalize with {"names": [...]} (or {"name": "..."}) and optional match_type, threshold,
+    n_grams and n_decimals returns {"results": [...]} with one result per name.
+    GET /health returns the server statistics.
+
+    Parameters
+    -----------
+    :param normalizer: the fitted normalizer
+    :param host: the host to bind (localhost by default)
+    :param port: the port to bind (0 picks a free port)
+    :param max_batch_size: the maximum number of names that are matched at once
+    :param max_delay: the time (in seconds) a batch waits for further requests
+    :param max_pending: the maximum number of names that are queued or matched at once
+    :param max_body_size: the maximum size (in bytes) of a request body
+
+    Examples
+    -----------
+    >>> normalizer = PrecisionOncologyNormalizer.load("ebi_drugs.preon")
+    >>> asyncio.run(NormalizationServer(normalizer, port=8000).serve_forever())
+    '''
+
+    def __init__(self, normalizer, host="127.0.0.1", port=8000, max_batch_size=256, max_delay=.002,
+                 max_pending=16384, max_body_size=2 ** 22):
+        self.normalizer = normalizer
+        self.host, self.port = host, port
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_body_size = max_body_size
+
+        self.stats = {"requests": 0, "names": 0, "batches": 0, "rejected": 0, "pending": 0}
+        self._server, self._queue, self._batcher, self._executor = None, None, None, None
+
+    async def start(self):
+        '''
+        Starts to accept connections and to match batches.
+        '''
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batcher = asyncio.ensure_future(self._run_batches())
+
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        '''
+        Stops the server and cancels pending requests.
+        '''
+        self._server.close()
+        await self._server.wait_closed()
+
+        self._batcher.cancel()
+
+        while not self._queue.empty():
+            self._queue.get_nowait()[2].cancel()
+
+        self._executor.shutdown(wait=True)
+
+    async def serve_forever(self):
+        '''
+        Starts the server and serves requests until it is cancelled.
+        '''
+        await self.start()
+
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def normalize(self, names, **query_args):
+        '''
+        Queues names to be matched in the next batches.
+
+        Parameters
+        -----------
+        :param names: a list of names
+        :param query_args: the arguments passed to the query method
+        :return: a list of query results, one for every name
+
+        Raises
+        ------
+        ValueError
+            If there are more names than can be pending at once.
+        OverflowError
+            If too many names are pending.
+        '''
+        if len(names) > self.max_pending:
+            raise ValueError(f"Too many names, at most {self.max_pending} names can be pending.")
+
+        if self.stats["pending"] + len(names) > self.max_pending:
+            self.stats["rejected"] += 1
+            raise OverflowError(f"Too many pending names, at most {self.max_pending} names can be pending.")
+
+        self.stats["pending"] += len(names)
+        loop, futures = asyncio.get_running_loop(), []
+
+        # large requests are split, so that they do not delay batches of other requests
+        for start in range(0, len(names), self.max_batch_size):
+            future = loop.create_future()
+            self._queue.put_nowait((names[start:start + self.max_batch_size], query_args, future))
+            futures.append(future)
+
+        try:
+            results = await asyncio.gather(*futures)
+        finally:
+            self.stats["pending"] -= len(names)
+
+        return [res for chunk in results for res in chunk]
+
+    async def _run_batches(self):
+        loop, carry = asyncio.get_running_loop(), None
+
+        while True:
+            batch = [await self._queue.get() if carry is None else carry]
+            n_names, carry = len(batch[0][0]), None
+
+            # wait shortly for concurrent requests; under load, requests queue up while the previous batch runs
+            if self.max_delay > 0 and n_names < self.max_batch_size:
+                await asyncio.sleep(self.max_delay)
+
+            while not self._queue.empty():
+                entry = self._queue.get_nowait()
+
+                # an entry that does not fit anymore starts the next batch
+                if n_names + len(entry[0]) > self.max_batch_size:
+                    carry = entry
+                    break
+
+                batch.append(entry)
+                n_names += len(entry[0])
+
+            # the batched query path requires the same query arguments
+            groups = dict()
+
+            for names, query_args, future in batch:
+                if future.cancelled(): continue
+                groups.setdefault(tuple(sorted(query_args.items())), []).append((names, future))
+
+            for query_args, entries in groups.items():
+                names = [name for entry_names, _ in entries for name in entry_names]
+
+                try:
+                    results, _ = await loop.run_in_executor(self._executor, partial(
+                        self.normalizer._query_batch, names, **dict(query_args)))
+                except Exception as error:
+                    for _, future in entries:
+                        if not future.done(): future.set_exception(error)
+
+                    continue
+
+                self.stats["batches"] += 1
+                start = 0
+
+                for entry_names, future in entries:
+                    if not future.done(): future.set_result(results[start:start + len(entry_names)])
+                    start += len(entry_names)
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if len(line) == 0: return None
+
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3: raise ValueError("Malformed request line.")
+
+        headers = dict()
+
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""): break
+
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        return parts[0], parts[1], parts[2], headers
+
+    def _write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        headers = [f"HTTP/1.1 {status} {REASONS[status]}", "Content-Type: application/json",
+                   f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+
+        if status == 503: headers.append("Retry-After: 1")
+
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+
+    async def _dispatch(self, method, path, body):
+        if path == "/health":
+            if method != "GET": return 405, {"error": "Use GET for /health."}
+            return 200, dict(status="ok", **self.stats)
+
+        if path != "/normalize":
+            return 404, {"error": f"Unknown path {path}."}
+
+        if method != "POST":
+            return 405, {"error": "Use POST for /normalize."}
+
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict): raise ValueError("The request must be a JSON object.")
+
+            names = request["names"] if "names" in request else [request.get("name")]
+
+            if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+                raise ValueError("names must be a list of strings (or name a string).")
+
+            query_args = _get_query_args(request)
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+        # such a request would be rejected even without any other pending names
+        if len(names) > self.max_pending:
+            return 413, {"error": f"The request exceeds {self.max_pending} names."}
+
+        self.stats["requests"] += 1
+        self.stats["names"] += len(names)
+
+        try:
+            results = await self.normalize(names, **query_args)
+        except OverflowError as error:
+            return 503, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": str(error)}
+
+        return 200, {"results": [_to_json(name, res) for name, res in zip(names, results)]}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as error:
+                    # also raised for lines above the stream limit
+                    self._write_response(writer, 400, {"error": str(error)}, keep_alive=False)
+                    break
+
+                if request is None: break
+                method, path, version, headers = request
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length < 0: raise ValueError("Negative Content-Length.")
+                except ValueError:
+                    self._write_response(writer, 400, {"error": "Invalid Content-Length."}, keep_alive=False)
+                    break
+
+                if length > self.max_body_size:
+                    self._write_response(writer, 413, {"error": f"The body exceeds {self.max_body_size} bytes."},
+                                         keep_alive=False)
+                    break
+
+                body = await reader.readexactly(length)
+                status, payload = await self._dispatch(method, path.split("?")[0], body)
+
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+
+                if not keep_alive: break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Serves a fitted normalizer snapshot over HTTP.")
+    parser.add_argument("snapshot", help="the snapshot file of the fitted normalizer (see PrecisionOncologyNormalizer.save)")
+    parser.add_argument("--host", default="127.0.0.1", help="the host to bind")
+    parser.add_argument("--port", type=int, default=8000, help="the port to bind")
+    parser.add_argument("--max-batch-size", type=int, default=256, help="the maximum number of names per batch")
+    parser.add_argument("--max-delay", type=float, default=.002, help="the time (in seconds) a batch waits")
+    parser.add_argument("--max-pending", type=int, default=16384, help="the maximum number of pending names")
+    args = parser.parse_args(args)
+
+    # the normalizer is loaded once (memory-mapped) and shared by all requests
+    normalizer = PrecisionOncologyNormalizer.load(args.snapshot)
+    normalizer.enable_warnings = False
+
+    server = NormalizationServer(normalizer, host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                                 max_delay=args.max_delay, max_pending=args.max_pending)
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b"PREONSNP"
+SNAPSHOT_VERSION = 6
+ALIGNMENT = 64
+
+
+def fingerprint(file_path, chunk_size=2 ** 20):
+    '''
+    Computes a fingerprint (SHA-256 digest) of a (resource) file.
+
+    Parameters
+    -----------
+    :param file_path: the path of the file
+    :param chunk_size: the number of bytes that are read at once
+    :return: the hex digest of the file content
+
+    Examples
+    -----------
+    >>> fingerprint("/Users/Username/Downloads/compounds.csv")
+    '''
+    digest = hashlib.sha256()
+
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def encode_strings(strings):
+    '''
+    Encodes strings as one UTF-8 byte array with offsets, which can be stored and memory-mapped.
+
+    Parameters
+    -----------
+    :param strings: a list of strings
+    :return: a tupel of the concatenated bytes and the offsets (one more than strings)
+
+    Examples
+    -----------
+    >>> data, offsets = encode_strings(["avastin", "isavuconazonium"])
+    '''
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(data, offsets):
+    '''
+    Decodes strings that were encoded with encode_strings.
+
+    Parameters
+    -----------
+    :param data: the concatenated bytes
+    :param offsets: the offsets of the strings
+    :return: a list of strings
+
+    Examples
+    -----------
+    >>> decode_strings(*encode_strings(["avastin", "isavuconazonium"]))
+    ['avastin', 'isavuconazonium']
+    '''
+    data, offsets = bytes(data), offsets.tolist()
+    return [data[start:stop].decode("utf-8") for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(file_path, arrays, meta_info):
+    '''
+    Writes numpy arrays and meta information into a versioned binary snapshot file. The file
+    starts with a magic number, the header size and a JSON header, followed by the raw
+    (aligned) array buffers, so that arrays can be memory-mapped when reading the file.
+
+    Parameters
+    -----------
+    :param file_path: the path of the snapshot file
+    :param arrays: a dictionary of named numpy arrays
+    :param meta_info: a JSON serializable dictionary of meta information
+
+    Examples
+    -----------
+    >>> write_snapshot("normalizer.preon", {"lengths": np.arange(3)}, {"engine": "scan"})
+    '''
+    arrays = {name: np.asarray(arr) for name, arr in arrays.items()}
+    layout, offset = dict(), 0
+
+    for name, arr in arrays.items():
+        order = "F" if arr.ndim > 1 and arr.flags["F_CONTIGUOUS"] and not arr.flags["C_CONTIGUOUS"] else "C"
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "order": order, "offset": offset}
+        offset = _align(offset + arr.nbytes)
+
+    header = json.dumps({"version": SNAPSHOT_VERSION, "meta_info": meta_info, "arrays": layout}).encode("utf-8")
+    data_start = _align(len(SNAPSHOT_MAGIC) + 8 + len(header))
+
+    with open(file_path, "wb") as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+
+        for name, arr in arrays.items():
+            file.seek(data_start + layout[name]["offset"])
+            file.write(arr.tobytes(order=layout[name]["order"]))
+
+        file.truncate(data_start + offset)
+
+
+def read_snapshot(file_path, mmap=True):
+    '''
+    Reads a snapshot file that was written with write_snapshot.
+
+    Parameters
+    -----------
+    :param file_path: the path of the snapshot file
+    :param mmap: a flag to decide whether arrays are memory-mapped (read-only) instead of read into memory
+    :return: a tupel of the named arrays and the meta information
+
+    Raises
+    ------
+    ValueError
+        If the file is not a preon snapshot or was written with an incompatible version.
+
+    Examples
+    -----------
+    >>> arrays, meta_info = read_snapshot("normalizer.preon")
+    '''
+    with open(file_path, "rb") as file:
+        if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{file_path} is not a preon snapshot file.")
+
+        header_size, = struct.unpack("<Q", file.read(8))
+        header = json.loads(file.read(header_size).decode("utf-8"))
+
+        if header["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot version {header['version']} is not supported (expected {SNAPSHOT_VERSION}).")
+
+        data_start = _align(len(SNAPSHOT_MAGIC) + 8 + header_size)
+        arrays = dict()
+
+        for name, layout in header["arrays"].items():
+            dtype, shape, order = np.dtype(layout["dtype"]), tuple(layout["shape"]), layout["order"]
+            offset = data_start + layout["offset"]
+
+            if mmap and int(np.prod(shape)) > 0:
+                arrays[name] = np.memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=shape, order=order)
+            else:
+                file.seek(offset)
+                arr = np.fromfile(file, dtype=dtype, count=int(np.prod(shape)))
+                arrays[name] = arr.reshape(shape, order=order)
+
+    return arrays, header["meta_info"]
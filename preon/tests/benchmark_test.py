@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import unittest
+
+from preon.benchmark import MATCH_TYPES, main, run_benchmarks, synthetic_names, synthetic_queries
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_synthetic_data(self):
+        names, name_ids = synthetic_names(1000)
+        queries = synthetic_queries(names, 100)
+
+        assert len(names) == len(set(name_ids)) == 1000
+        assert all(5 <= len(name) <= 30 for name in names)
+        assert len(queries) == 100
+        assert synthetic_names(1000) == (names, name_ids)
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(sizes=(1000,), gold_standards=(), engines=("scan", "qgram"), n_queries=200)
+        assert len(results["synthetic"]) == 2
+
+        for res in results["synthetic"]:
+            assert res["n_names"] == 1000 and res["n_queries"] == 200
+            assert res["memory"]["fit_peak"] >= res["memory"]["fitted"] > 0
+            assert res["memory"]["retained"] > 0
+            assert res["throughput"]["names_per_second"] > 0
+
+            # every match type occurs in synthetic queries
+            assert sum(res["latency"][match_type]["count"] for match_type in MATCH_TYPES) == 200
+
+            for match_type in MATCH_TYPES:
+                stats = res["latency"][match_type]
+                assert stats["count"] > 0
+                assert stats["p50"] <= stats["p90"] <= stats["p99"] <= stats["max"]
+
+        self.assertRaises(ValueError, run_benchmarks, sizes=(), gold_standards=("unknown",))
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "results.json")
+            main(["--sizes", "500", "--gold-standards", "--n-queries", "50", "--no-memory", "--output", file_path])
+
+            with open(file_path) as file:
+                results = json.load(file)
+
+            assert results["synthetic"][0]["n_names"] == 500
+            assert "memory" not in results["synthetic"][0]
+            assert results["gold_standards"] == []
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from preon import ontology
+from preon.cancer import load_mesh_cancers, load_do_cancers, load_do_flat_mapping
+
+MESH_FILE = '''<?xml version="1.0"?>
+<!DOCTYPE DescriptorRecordSet SYSTEM "https://www.nlm.nih.gov/databases/dtd/nlmdescriptorrecordset_20220101.dtd">
+<DescriptorRecordSet LanguageCode = "eng">
+<DescriptorRecord DescriptorClass = "1">
+  <DescriptorUI>D000008</DescriptorUI>
+  <DescriptorName><String>Abdominal Neoplasms</String></DescriptorName>
+  <PharmacologicalActionList><PharmacologicalAction><DescriptorReferredTo><DescriptorUI>D000999</DescriptorUI><DescriptorName><String>Other</String></DescriptorName></DescriptorReferredTo></PharmacologicalAction></PharmacologicalActionList>
+  <TreeNumberList>
+   <TreeNumber>C04.588.033</TreeNumber>
+  </TreeNumberList>
+</DescriptorRecord>
+<DescriptorRecord DescriptorClass = "1">
+  <DescriptorUI>D000001</DescriptorUI>
+  <DescriptorName><String>Calcimycin</String></DescriptorName>
+  <TreeNumberList><TreeNumber>D03.633.100</TreeNumber></TreeNumberList>
+</DescriptorRecord>
+<DescriptorRecord DescriptorClass = "1">
+  <DescriptorUI>D018303</DescriptorUI>
+  <DescriptorName><String>Angiomatosis &amp; Bacillary</String></DescriptorName>
+  <TreeNumberList><TreeNumber>C01.150</TreeNumber><TreeNumber>C04.557</TreeNumber></TreeNumberList>
+</DescriptorRecord>
+<DescriptorRecord DescriptorClass = "1">
+  <DescriptorUI>D000002</DescriptorUI>
+  <DescriptorName><String>No Tree</String></DescriptorName>
+</DescriptorRecord>
+</DescriptorRecordSet>
+'''
+
+
+DO_FILE = '''format-version: 1.2
+ontology: doid
+
+[Term]
+id: DOID:4
+name: disease
+
+[Term]
+id: DOID:14566
+name: disease of cellular proliferation
+is_a: DOID:4 ! disease
+
+[Term]
+id: DOID:162
+name: cancer
+synonym: "malignant neoplasm" EXACT []
+synonym: "primary cancer" EXACT []
+is_a: DOID:14566 ! disease of cellular proliferation
+
+[Term]
+id: DOID:0050687
+name: cell type cancer
+is_a: DOID:162 ! cancer
+
+[Term]
+id: DOID:0050686
+name: organ system cancer
+is_a: DOID:162 ! cancer
+
+[Term]
+id: DOID:305
+name: carcinoma
+synonym: "epithelial neoplasm" EXACT []
+synonym: "carcinoma, NOS" RELATED []
+is_a: DOID:0050687 ! cell type cancer
+
+[Term]
+id: DOID:1612
+name: breast cancer
+synonym: "mammary cancer" EXACT []
+synonym: "malignant tumor of the breast" EXACT []
+is_a: DOID:0050686 ! organ system cancer
+
+[Term]
+id: DOID:3459
+name: breast carcinoma
+is_a: DOID:305 ! carcinoma
+is_a: DOID:1612 ! breast cancer
+
+[Term]
+id: DOID:3007
+name: breast ductal carcinoma
+synonym: "ductal carcinoma of breast" EXACT []
+is_a: DOID:3459 ! breast carcinoma
+
+[Term]
+id: DOID:9999
+name: obsolete cancer
+is_obsolete: true
+'''
+
+
+class CancerLoaderTest(unittest.TestCase):
+    def test_load_mesh_cancers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "mesh.xml")
+
+            with open(file_path, "w") as file:
+                file.write(MESH_FILE)
+
+            # only neoplasms (C04 tree numbers) are loaded, with their own descriptor ui
+            assert load_mesh_cancers(file_path) == (["Abdominal Neoplasms", "Angiomatosis & Bacillary"],
+                                                    ["MESH:D000008", "MESH:D018303"])
+
+    def test_load_do_cancers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "do.obo")
+
+            with open(file_path, "w") as file:
+                file.write(DO_FILE)
+
+            ontology._ontologies.clear()
+            cancer_types, doids = load_do_cancers(file_path)
+            expanded_types, expanded_doids = load_do_cancers(file_path, expand_doids=True)
+            flat_mapping = load_do_flat_mapping(file_path)
+
+            assert sorted(zip(cancer_types, doids)) == [
+                ("breast cancer", "DOID:1612"), ("breast carcinoma", "DOID:3459"),
+                ("breast ductal carcinoma", "DOID:3007"), ("carcinoma", "DOID:305"),
+                ("cell type cancer", "DOID:0050687"), ("ductal carcinoma of breast", "DOID:3007"),
+                ("epithelial neoplasm", "DOID:305"), ("malignant tumor of the breast", "DOID:1612"),
+                ("mammary cancer", "DOID:1612"), ("organ system cancer", "DOID:0050686")]
+
+            # every name maps to itself (three times), its subclasses and its superclasses
+            assert sorted(doid for name, doid in zip(expanded_types, expanded_doids) if name == "carcinoma") == [
+                "DOID:0050687", "DOID:14566", "DOID:162", "DOID:3007", "DOID:305", "DOID:305", "DOID:305",
+                "DOID:3459", "DOID:4"]
+
+            assert flat_mapping["DOID:3007"] == ["DOID:0050687", "DOID:305", "DOID:0050686", "DOID:1612"]
+
+            # a new process loads the cached ontology instead of parsing the file
+            ontology._ontologies.clear()
+
+            with mock.patch.object(ontology.Ontology, "from_obo", side_effect=AssertionError):
+                assert load_do_cancers(file_path) == (cancer_types, doids)
+                assert load_do_cancers(file_path, expand_doids=True) == (expanded_types, expanded_doids)
+                assert load_do_flat_mapping(file_path) == flat_mapping
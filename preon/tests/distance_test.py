@@ -0,0 +1,46 @@
+import random
+import string
+import unittest
+
+import jellyfish
+import numpy as np
+
+from preon.distance import encode_names, decode_names, levenshtein_distances
+
+
+def _random_name(rng, alphabet, max_len):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, max_len)))
+
+
+class LevenshteinDistancesTest(unittest.TestCase):
+
+    def test_levenshtein_distances(self):
+        rng = random.Random(4711)
+        random_name = lambda max_len: _random_name(rng, string.ascii_lowercase[:6], max_len)
+
+        names = [random_name(70) for _ in range(500)]
+        queries = [random_name(70) for _ in range(50)] + ["", "z", "a" * 64, "b" * 65]
+
+        codes, lengths, alphabet = encode_names(names)
+        assert decode_names(codes, lengths, alphabet) == names
+        assert codes.shape == (sum(len(name) for name in names),)
+
+        dists = levenshtein_distances(queries, codes, lengths, alphabet, max_cells=2 ** 12)
+        expected = [[jellyfish.levenshtein_distance(query, name) for name in names] for query in queries]
+
+        assert np.array_equal(dists, expected)
+
+    def test_bounded_levenshtein_distances(self):
+        rng = random.Random(815)
+        random_name = lambda max_len: _random_name(rng, string.ascii_lowercase[:4], max_len)
+
+        names = [random_name(40) for _ in range(500)]
+        queries = [random_name(40) for _ in range(50)] + names[:10] + ["c" * 65]
+
+        codes, lengths, alphabet = encode_names(names)
+        max_dists = np.array([rng.randint(-1, 20) for _ in queries])
+
+        dists = levenshtein_distances(queries, codes, lengths, alphabet, max_dists=max_dists)
+        expected = [[jellyfish.levenshtein_distance(query, name) for name in names] for query in queries]
+
+        assert np.array_equal(dists, np.minimum(expected, max_dists[:, None] + 1))
@@ -0,0 +1,124 @@
+import gzip
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from preon.download import download_file
+
+
+class _ResourceHandler(BaseHTTPRequestHandler):
+    # serves server.content with an ETag, and supports conditional, range and gzip requests
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        etag = f'"{hash(server.content)}"'
+        content, status, headers = server.content, 200, {"ETag": etag}
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        if "gzip" in self.headers.get("Accept-Encoding", "") and server.compress:
+            content = gzip.compress(content, mtime=0)
+            headers["Content-Encoding"] = "gzip"
+
+        if self.headers.get("Range") is not None and self.headers.get("If-Range") == etag:
+            offset = int(self.headers["Range"][len("bytes="):-1])
+            headers["Content-Range"] = f"bytes {offset}-{len(content) - 1}/{len(content)}"
+            content, status = content[offset:], 206
+
+        self.send_response(status)
+
+        for key, value in headers.items():
+            self.send_header(key, value)
+
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+
+        # simulate a dropped connection after a part of the content
+        if server.fail_after is not None:
+            self.wfile.write(content[:server.fail_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _ResourceHandler)
+        self.server.content, self.server.compress, self.server.fail_after = b"", False, None
+        self.server.requests = []
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/doid.obo"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, "do.obo")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def _read(self):
+        with open(self.file_path, "rb") as file:
+            return file.read()
+
+    def test_conditional_download(self):
+        self.server.content = b"format-version: 1.2\n" * 1000
+
+        assert download_file(self.url, self.file_path, chunk_size=100) is True
+        assert self._read() == self.server.content
+
+        # unchanged files are not transferred again
+        assert download_file(self.url, self.file_path) is False
+        assert "If-None-Match" in self.server.requests[-1]
+
+        self.server.content = b"format-version: 1.4\n" * 1000
+
+        assert download_file(self.url, self.file_path) is True
+        assert self._read() == self.server.content
+
+    def test_resume_download(self):
+        self.server.content = b"".join(f"[Term]\nid: DOID:{idx}\n".encode() for idx in range(1000))
+        self.server.fail_after = 5000
+
+        with open(self.file_path, "wb") as file:
+            file.write(b"old")
+
+        # an interrupted download keeps the stored file
+        with self.assertRaises(ConnectionError):
+            download_file(self.url, self.file_path, chunk_size=100)
+
+        assert self._read() == b"old"
+        assert os.path.getsize(f"{self.file_path}.part") == 5000
+
+        self.server.fail_after = None
+
+        assert download_file(self.url, self.file_path) is True
+        assert self.server.requests[-1]["Range"] == "bytes=5000-"
+        assert self._read() == self.server.content
+        assert not os.path.exists(f"{self.file_path}.part")
+
+    def test_gzip_download(self):
+        self.server.content, self.server.compress = b"[Term]\nid: DOID:162\nname: cancer\n" * 1000, True
+        self.server.fail_after = 100
+
+        with self.assertRaises(ConnectionError):
+            download_file(self.url, self.file_path, chunk_size=10)
+
+        self.server.fail_after = None
+
+        assert download_file(self.url, self.file_path, chunk_size=10) is True
+        assert self._read() == self.server.content
+        assert download_file(self.url, self.file_path) is False
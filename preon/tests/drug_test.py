@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from preon.drug import load_ebi_drugs, load_drugbank_drugs
+
+EBI_FILE = '''"ChEMBL ID";"Name";"Synonyms";"Type"
+"CHEMBL1";"Aspirin";"ASA|Acetylsalicylic acid";"Small molecule"
+"CHEMBL2";"";"Synonym only";"Small molecule"
+"";"No ID";"Ignored";"Small molecule"
+"CHEMBL3";"Empty synonym";"a||b";"Small molecule"
+"CHEMBL4";"No synonyms";"";"Small molecule"
+'''
+
+DB_FILE = '''DrugBank ID,Accession Numbers,Common name,CAS,UNII,Synonyms,Standard InChI Key
+DB00001,BIOD00024,Lepirudin,138068-37-8,Y43GF64R34,"Hirudin variant-1 | Lepirudin recombinant",X
+DB00002,BIOD00071,Cetuximab,205923-56-4,PQX0D8J21J,,Y
+DB00003,BIOD00001,Dornase alfa,143831-71-4,953A26OA1Y,"Deoxyribonuclease I|DNase",Z
+'''
+
+
+class DrugLoaderTest(unittest.TestCase):
+    def _write(self, tmp_dir, file_name, content):
+        file_path = os.path.join(tmp_dir, file_name)
+
+        with open(file_path, "w") as file:
+            file.write(content)
+
+        return file_path
+
+    def test_load_ebi_drugs(self):
+        # rows without name or id are skipped
+        expected = (["Aspirin", "ASA", "Acetylsalicylic acid", "Empty synonym", "a", "", "b", "No synonyms"],
+                    ["CHEMBL1", "CHEMBL1", "CHEMBL1", "CHEMBL3", "CHEMBL3", "CHEMBL3", "CHEMBL3", "CHEMBL4"])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = self._write(tmp_dir, "ebi_drugs.csv", EBI_FILE)
+
+            assert load_ebi_drugs(file_path) == expected
+
+    def test_load_drugbank_drugs(self):
+        expected = (["Lepirudin", "Hirudin variant-1", "Lepirudin recombinant", "Cetuximab", "Dornase alfa",
+                     "Deoxyribonuclease I|DNase"], ["DB00001", "DB00001", "DB00001", "DB00002", "DB00003", "DB00003"])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = self._write(tmp_dir, "drugbank_drugs.csv", DB_FILE)
+
+            assert load_drugbank_drugs(file_path) == expected
@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# the time (in seconds) importing a preon module may take on top of numpy, which every module needs
+IMPORT_BUDGET = .25
+
+HEAVY_MODULES = ("pandas", "tqdm", "daproli", "lxml", "pronto", "multiprocessing")
+
+SCRIPT = '''
+import json, sys, time
+import numpy
+
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start
+
+{code}
+
+print(json.dumps({{"import_time": import_time, "modules": sorted(sys.modules)}}))
+'''
+
+
+def _run(module, code=""):
+    # every run needs a fresh interpreter, as imported modules are cached
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+
+    output = subprocess.run([sys.executable, "-c", SCRIPT.format(module=module, code=code)], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+class ImportTest(unittest.TestCase):
+
+    def test_import_budget(self):
+        for module in ("preon.normalization", "preon.drug", "preon.cancer", "preon.ontology", "preon.server"):
+            res = _run(module)
+
+            assert res["import_time"] < IMPORT_BUDGET, (module, res["import_time"])
+            assert not any(heavy in res["modules"] for heavy in HEAVY_MODULES), module
+
+    def test_lazy_query(self):
+        # a one-shot query does not need any of the heavy dependencies
+        res = _run("preon.normalization", code='''
+normalizer = preon.normalization.PrecisionOncologyNormalizer(enable_warnings=False)
+normalizer.fit(["Avastin", "Cisplatin"], ["ID1", "ID2"])
+assert normalizer.query("Avastin and Cisplatin")[1] == [["ID1"], ["ID2"]]
+assert normalizer.query("Avstin")[1] == [["ID1"]]
+''')
+
+        assert not any(heavy in res["modules"] for heavy in HEAVY_MODULES)
+
+        res = _run("preon.normalization", code='''
+normalizer = preon.normalization.PrecisionOncologyNormalizer().fit(["Avastin"], ["ID1"])
+normalizer.transform(["Avastin"])
+''')
+
+        assert "pandas" in res["modules"]
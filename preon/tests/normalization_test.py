@@ -1,17 +1,534 @@
 import os
+import random
 import shutil
+import string
 import tempfile
 import unittest
 
+import jellyfish
+import numpy as np
+import pandas as pd
+
 from preon.cancer import download_or_load_do_cancers, load_do_flat_mapping, apply_do_flat_mapping_to_ontology, \
     apply_do_flat_mapping_to_goldstandard, \
     load_database_cancer_goldstandard, load_ncbi_cancer_goldstandard
 from preon.drug import load_ebi_drugs, load_charite_drug_goldstandard, load_database_drug_goldstandard, \
     load_ctg_drug_goldstandard, store_ebi_drugs, store_drugbank_drugs, load_drugbank_drugs
+from preon.index import max_edit_distances
+from preon.metrics import MetricsRecorder
+from preon.ontology import HierarchyIndex
 from preon.normalization import PrecisionOncologyNormalizer
 from preon.tests.utils import f1_score
 
 
+def _random_names(n_names, seed=2357):
+    rng = random.Random(seed)
+    names = ["Avastin", "Bevacizumab", "Ixabepilone", "Isavuconazonium", "Cisplatin", "Carboplatin"]
+
+    while len(names) < n_names:
+        length = rng.randint(3, 20)
+        names.append("".join(rng.choice(string.ascii_lowercase[:8]) for _ in range(length)))
+
+    return names, [f"ID{idx}" for idx in range(len(names))]
+
+
+def _linear_partial_match(normalizer, query_name, threshold=.2, n_decimals=3):
+    # reference implementation: scan the whole dictionary
+    query_name = normalizer._transform_name(query_name)
+    names = list(normalizer.names)
+
+    distances = [jellyfish.levenshtein_distance(query_name, name) / max(len(query_name), len(name)) for name in names]
+    if n_decimals is not None: distances = np.round(distances, n_decimals)
+
+    min_dist = np.min(distances)
+    if min_dist > threshold: return None
+
+    return sorted(name for name, dist in zip(names, distances) if dist == min_dist), min_dist
+
+
+def _random_queries(names, n_queries, seed=1113):
+    rng = random.Random(seed)
+    queries = ["Isavuconaconium", "Avastn", "Carbo platin", "xyz", "a", "!!!"]
+
+    while len(queries) < n_queries:
+        query = list(rng.choice(names).lower())
+
+        for _ in range(rng.randint(0, 4)):
+            pos = rng.randrange(len(query) + 1)
+            op = rng.choice(("insert", "delete", "replace"))
+            char = rng.choice(string.ascii_lowercase[:8])
+
+            if op == "insert":
+                query.insert(pos, char)
+            elif op == "delete" and pos < len(query):
+                del query[pos]
+            elif pos < len(query):
+                query[pos] = char
+
+        queries.append("".join(query))
+
+    return queries
+
+
+def _ngram_substring_match(normalizer, query_name, n_grams):
+    # reference implementation: probe the dictionary with every transformed n-gram of consecutive tokens
+    tokens = query_name.split(" ")
+    grams = [" ".join(tokens[idx:idx + n]) for n in range(1, max(n_grams, 1) + 1) for idx in range(len(tokens) - n + 1)]
+    matches = {normalizer._transform_name(gram) for gram in grams} - {""}
+    return sorted(matches & set(normalizer.names))
+
+
+class PartialMatchingTest(unittest.TestCase):
+
+    def _assert_partial_matches(self, normalizer, queries, **query_args):
+        for query in queries:
+            res = normalizer.query(query, match_type="partial", **query_args)
+            expected = _linear_partial_match(normalizer, query, **query_args)
+
+            if expected is None:
+                assert res is None, query
+                continue
+
+            found_names, _, meta_info = res
+            assert found_names == expected[0], query
+            assert meta_info["edit_distance"] == expected[1], query
+
+    def _test_engine(self, engine):
+        names, ids = _random_names(1000)
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine).fit(names, ids)
+        queries = _random_queries(names, 100)
+
+        self._assert_partial_matches(normalizer, queries)
+        self._assert_partial_matches(normalizer, queries, threshold=.35, n_decimals=None)
+        self._assert_partial_matches(normalizer, queries, threshold=.1, n_decimals=1)
+
+    def test_length_pruning(self):
+        self._test_engine("scan")
+
+    def test_bktree_engine(self):
+        self._test_engine("bktree")
+
+    def test_qgram_engine(self):
+        self._test_engine("qgram")
+
+    def test_symspell_engine(self):
+        names, ids = _random_names(1000)
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine="symspell", max_edit_distance=3)
+        normalizer.fit(names, ids)
+        queries = _random_queries(names, 100)
+
+        # names are at most 20 characters long, so these thresholds never exceed 3 edits
+        self._assert_partial_matches(normalizer, queries, threshold=.15, n_decimals=None)
+        self._assert_partial_matches(normalizer, queries, threshold=.1, n_decimals=1)
+
+        found_names, _, meta_info = normalizer.query("Isavuconaconium")
+        assert found_names == ['isavuconazonium']
+        assert meta_info["edit_distance"] == 0.067
+
+    def test_max_edit_distances(self):
+        lengths = np.arange(1, 40)
+
+        for threshold, n_decimals in ((.2, 3), (.2, None), (.1996, 3), (.15, 1), (0, 3)):
+            radii = max_edit_distances(12, lengths, threshold, n_decimals)
+
+            for length, radius in zip(lengths, radii):
+                dists = np.arange(max(12, length) + 1) / max(12, length)
+                if n_decimals is not None: dists = np.round(dists, n_decimals)
+                assert radius == np.flatnonzero(dists <= threshold).max(initial=-1)
+
+
+class TransformTest(unittest.TestCase):
+
+    def test_batch_transform(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 100)
+
+        for engine in ("scan", "bktree"):
+            normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine).fit(names, ids)
+            df = normalizer.transform(queries, batch_size=16)
+
+            for query, found_names, match_type, edit_distance in zip(df["Name"], df["Found Names"], df["Match Type"],
+                                                                      df["Edit Distance"]):
+                res = normalizer.query(query)
+
+                if res is None:
+                    assert match_type == "none"
+                    continue
+
+                assert found_names == res[0]
+                assert match_type == res[2]["match_type"]
+                assert edit_distance == res[2].get("edit_distance", None) or edit_distance != edit_distance
+
+    def test_parallel_transform(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 100)
+
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+        columns = ["Name", "Found Names", "Found Name IDs", "Match Type", "Edit Distance"]
+
+        df = normalizer.transform(queries, batch_size=8)
+        df_parallel = normalizer.transform(queries, batch_size=8, n_jobs=2)
+
+        assert df[columns].equals(df_parallel[columns])
+
+    def test_deduplicated_transform(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 30)
+        queries = queries + [query.upper() for query in queries] + queries[::-1]
+
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+        df = normalizer.transform(queries)
+
+        for query, found_names, found_ids in zip(queries, df["Found Names"], df["Found Name IDs"]):
+            res = normalizer.query(query)
+            assert (found_names, found_ids) == (([], [[None]]) if res is None else res[:2])
+
+        # duplicates receive their own result lists
+        df["Found Names"][0].append("modified")
+        assert df["Found Names"][30] != df["Found Names"][0]
+
+    def test_transform_iter(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 50)
+
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+        columns = ["Name", "Found Names", "Found Name IDs", "Match Type", "Edit Distance"]
+        df = normalizer.transform(queries)
+
+        chunks = list(normalizer.transform_iter(iter(queries), chunk_size=16))
+        assert [chunk.shape[0] for chunk in chunks] == [16, 16, 16, 2]
+        assert pd.concat(chunks, ignore_index=True)[columns].equals(df[columns])
+
+        records = [record for chunk in normalizer.transform_iter(queries, chunk_size=7, as_records=True)
+                   for record in chunk]
+        assert [record["Found Names"] for record in records] == df["Found Names"].tolist()
+
+
+class InternedIdsTest(unittest.TestCase):
+
+    def test_interned_ids(self):
+        names = ["Cisplatin", "cis-platin", "Cisplatin", "Carboplatin", "Avastin", "Bevacizumab", "avastin"]
+        ids = ["ID3", "ID1", "ID3", "ID2", "ID5", "ID5", "ID4"]
+
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+
+        assert normalizer.query("Cisplatin")[:2] == (["cisplatin"], [["ID1", "ID3"]])
+        assert normalizer.query("Avastin Bevacizumab")[:2] == (["avastin", "bevacizumab"], [["ID4", "ID5"], ["ID5"]])
+        assert normalizer._postings.shape[0] == 6
+
+        # the public names still map every name to its ids
+        assert dict(normalizer.names) == {"cisplatin": ["ID1", "ID3"], "carboplatin": ["ID2"], "avastin": ["ID4", "ID5"],
+                                          "bevacizumab": ["ID5"]}
+
+        normalizer.partial_fit(["Cisplatin", "Paclitaxel"], ["ID6", "ID7"]).remove(names=["Carboplatin"])
+        assert dict(normalizer.names) == {"cisplatin": ["ID1", "ID3", "ID6"], "avastin": ["ID4", "ID5"],
+                                          "bevacizumab": ["ID5"], "paclitaxel": ["ID7"]}
+
+
+class IdMappingTest(unittest.TestCase):
+
+    def test_id_mapping(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 100) + ["Avastin and Cisplatin", "cisplatin carboplatin"]
+        rng = random.Random(7)
+
+        # some ids are not mapped at all, or to no ids
+        flat_mapping = {name_id: rng.sample(ids[:20], rng.randint(0, 3)) for name_id in ids if rng.random() < .8}
+        index = HierarchyIndex(ids, [(name_id, rng.choice(ids[:idx])) for idx, name_id in enumerate(ids) if idx > 0])
+
+        mappings = ((flat_mapping, lambda name_id: flat_mapping.get(name_id, [])),
+                    (index, lambda name_id: index.descendants(name_id) + index.ancestors(name_id)))
+
+        for id_mapping, expand in mappings:
+            # expanding the ids at fit time duplicates names, the id mapping expands the matched ids only
+            expanded = [(name, mapped_id) for name, name_id in zip(names, ids) for mapped_id in expand(name_id)]
+            expected = PrecisionOncologyNormalizer(enable_warnings=False).fit(*zip(*expanded))
+
+            for engine in ("scan", "qgram"):
+                normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine, id_mapping=id_mapping)
+                normalizer.fit(names, ids)
+
+                assert normalizer._postings.shape[0] == len(set(ids))
+
+                for query in queries:
+                    for match_type in ("all", "exact", "substring", "partial"):
+                        assert normalizer.query(query, match_type) == expected.query(query, match_type), query
+
+        # a name without mapped ids does not match, the next stage finds a name with mapped ids
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False, id_mapping={"A": ["X"]})
+        normalizer.fit(["cisplatin", "cisplatinum"], ["B", "A"])
+
+        assert normalizer.query("cisplatin")[:2] == (["cisplatinum"], [["X"]])
+        assert normalizer.query("cisplatin")[2]["match_type"] == "partial"
+        assert normalizer.query("cisplatin", match_type="exact") is None
+
+        normalizer.partial_fit(["cisplatin"], ["A"])
+        assert normalizer.query("cisplatin") == (["cisplatin"], [["X"]], {"match_type": "exact"})
+
+        normalizer.remove(name_ids=["A"])
+        assert normalizer.query("cisplatin") is None
+
+        # vocabularies without mapped ids are dropped from the result
+        normalizer.fit_vocabularies({"chembl": (["cisplatin"], ["A"]), "drugbank": (["cisplatin"], ["B"])})
+        assert normalizer.query("cisplatin")[1] == [{"chembl": ["X"]}]
+
+
+class VocabularyTest(unittest.TestCase):
+
+    def test_vocabularies(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 100) + ["Avastin and Cisplatin"]
+
+        # two vocabularies that share a part of their names
+        vocabularies = {"chembl": (names[:700], ids[:700]),
+                        "drugbank": (names[500:], [f"DB{idx}" for idx in range(500)])}
+
+        expected = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+        separate = {source: PrecisionOncologyNormalizer(enable_warnings=False).fit(*vocabulary)
+                    for source, vocabulary in vocabularies.items()}
+
+        for engine in ("scan", "qgram"):
+            normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine)
+            normalizer.fit_vocabularies(vocabularies)
+
+            # every name is stored once
+            assert len(normalizer.names) == len(expected.names)
+
+            for query in queries:
+                res, expected_res = normalizer.query(query), expected.query(query)
+
+                if expected_res is None:
+                    assert res is None, query
+                    continue
+
+                assert res[0] == expected_res[0] and res[2] == expected_res[2], query
+
+                for found_name, grouped in zip(res[0], res[1]):
+                    assert grouped == {source: separate[source]._get_name_ids(found_name) for source in separate
+                                       if found_name in separate[source].names}, query
+
+        normalizer.partial_fit(["Avastin"], ["DB-1"], source="drugbank")
+        assert normalizer.query("Avastin")[1] == [{"chembl": ["ID0"], "drugbank": ["DB-1"]}]
+
+        normalizer.remove(name_ids=["DB-1", "ID0"], source="drugbank")
+        assert normalizer.query("Avastin")[1] == [{"chembl": ["ID0"]}]
+
+        normalizer.remove(name_ids=["ID0"])
+        assert normalizer.query("Avastin", match_type="exact") is None
+
+        self.assertRaises(ValueError, normalizer.partial_fit, ["Avastin"], ["ID0"])
+        self.assertRaises(ValueError, expected.partial_fit, ["Avastin"], ["ID0"], source="chembl")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "vocabularies.preon")
+            normalizer.save(file_path)
+            loaded = PrecisionOncologyNormalizer.load(file_path)
+
+            assert loaded.sources == ["chembl", "drugbank"]
+
+            for query in queries:
+                assert loaded.query(query) == normalizer.query(query)
+
+        df_eval = normalizer.evaluate(["Cisplatin", "Carboplatin"], [["ID4"], ["DB0"]])
+        assert df_eval["Correct Match"].tolist() == [1, 0]
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+
+    def test_partial_fit_remove(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 100)
+
+        removed_names, removed_ids = names[200:250], ids[500:550] + ["ID0"]
+        expected = [(name, name_id) for name, name_id in zip(names + ["Avastin"], ids + ["ID7"])
+                    if name not in removed_names and name_id not in removed_ids]
+        expected_names, expected_ids = zip(*expected)
+
+        for engine in ("scan", "bktree", "symspell", "qgram"):
+            expected = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine)
+            expected.fit(expected_names, expected_ids)
+
+            normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine, cache_size=100)
+            normalizer.fit(names[:900], ids[:900]).query("Avastin")
+
+            normalizer.partial_fit(names[900:] + ["Avastin"], ids[900:] + ["ID7"])
+            normalizer.remove(names=removed_names, name_ids=removed_ids)
+
+            assert normalizer.query("Avastin")[:2] == (["avastin"], [["ID7"]])
+            assert sorted(normalizer.names) == sorted(expected.names)
+
+            for query in queries:
+                assert normalizer.query(query) == expected.query(query), query
+
+            # merging the updates keeps the results
+            normalizer._compact()
+
+            for query in queries:
+                assert normalizer.query(query) == expected.query(query), query
+
+        # changing the ids of many fitted names also merges the updates
+        names, ids = _random_names(3000)
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+        normalizer.partial_fit(names[:1500], [f"{name_id}-2" for name_id in ids[:1500]])
+
+        assert len(normalizer._delta_postings) == 0
+        assert normalizer.query(names[0])[1] == [sorted([ids[0], f"{ids[0]}-2"])]
+
+
+class SubstringMatchingTest(unittest.TestCase):
+
+    def test_substring_trie(self):
+        names, ids = _random_names(1000)
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names[:900] + ["B", "Epothilone B"],
+                                                                             ids[:900] + ["ID1001", "ID1002"])
+        normalizer.partial_fit(names[900:], ids[900:]).remove(names=names[850:950])
+
+        rng = random.Random(42)
+        tokens = names + ["", "B", "Epothilone", "analog", "-", "(Avastin)"]
+
+        # short queries probe the n-grams, long queries of single characters walk the tries
+        queries = [(" ".join(rng.choice(tokens) for _ in range(rng.randint(1, 8))), range(0, 5)) for _ in range(300)]
+        queries += [(" ".join(rng.choice(string.ascii_lowercase[:8] + "-B") for _ in range(rng.randint(500, 1000))),
+                     (10, 40)) for _ in range(10)]
+
+        for query, n_grams_range in queries:
+            for n_grams in n_grams_range:
+                res = normalizer.query(query, match_type="substring", n_grams=n_grams)
+                expected = _ngram_substring_match(normalizer, query, n_grams)
+
+                if len(expected) == 0:
+                    assert res is None, query
+                else:
+                    assert res[0] == expected, query
+
+    def test_substring_consecutive_tokens(self):
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(["c", "dcdc"], ["ID1", "ID2"])
+
+        # n-grams only span consecutive tokens, they are no longer built over the extended token list
+        assert normalizer.query("D C", match_type="substring", n_grams=3)[:2] == (["c"], [["ID1"]])
+        assert normalizer.query("D C D C", match_type="substring", n_grams=3)[:2] == (["c"], [["ID1"]])
+        assert normalizer.query("D C D C", match_type="substring", n_grams=4)[:2] == (["c", "dcdc"], [["ID1"], ["ID2"]])
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def test_query_cache(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 50)
+
+        normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+        cached_normalizer = PrecisionOncologyNormalizer(enable_warnings=False, cache_size=20).fit(names, ids)
+
+        for query in queries + queries[::-1]:
+            assert cached_normalizer.query(query) == normalizer.query(query)
+
+        cache_info = cached_normalizer.cache_info()
+        assert cache_info["size"] == 20 and cache_info["hits"] > 0
+        assert cache_info["hits"] + cache_info["misses"] == 2 * len(queries)
+
+        # same normalized tokens share an entry, different arguments do not
+        cached_normalizer.query("CIS-platin")
+        hits = cached_normalizer.cache_info()["hits"]
+
+        cached_normalizer.query("cisplatin")
+        assert cached_normalizer.cache_info()["hits"] == hits + 1
+
+        cached_normalizer.query("cisplatin", threshold=.3)
+        assert cached_normalizer.cache_info()["hits"] == hits + 1
+
+        cached_normalizer.fit(["Cisplatin Accord"], ["ID"])
+        assert cached_normalizer.cache_info()["size"] == 0
+        assert cached_normalizer.query("cisplatin") is None
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_metrics(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 100) + ["Avastin", "Avastin and Cisplatin"]
+        expected = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids).transform(queries)
+
+        for engine in ("scan", "bktree", "qgram"):
+            recorder = MetricsRecorder(n_slowest=5)
+            normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine, cache_size=1000,
+                                                     metrics=recorder).fit(names, ids)
+
+            # instrumentation does not change results
+            df = normalizer.transform(queries, batch_size=16)
+            assert df.drop(columns="Query Time").equals(expected.drop(columns="Query Time"))
+
+            summary = recorder.summary()
+            assert summary["n_queries"] == len(queries) and summary["cache_hits"] == 0
+            assert summary["match_types"]["partial"] == (df["Match Type"] == "partial").sum()
+            assert summary["stages"]["normalize"]["count"] == len(queries)
+            assert summary["stages"]["partial"]["count"] == summary["match_types"]["partial"] + \
+                   summary["match_types"]["none"]
+            assert summary["distance_computations"] > 0
+
+            # the BK-tree computes distances to the names on its search paths, not only to the matched ones
+            if engine == "bktree":
+                assert summary["distance_computations"] > summary["candidates"]
+
+            slowest = recorder.slowest()
+            assert len(slowest) == 5
+            assert all(first["time"] >= second["time"] for first, second in zip(slowest[:-1], slowest[1:]))
+
+            normalizer.query("Avastin")
+            assert recorder.summary()["cache_hits"] == 1
+
+            # worker processes pass their records to the callback of the calling process
+            records = []
+            normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine,
+                                                     metrics=lambda record: records.append(record)).fit(names, ids)
+            normalizer.transform(queries, batch_size=16, n_jobs=2)
+
+            assert sorted(record["name"] for record in records) == sorted(queries)
+            assert sum(record["distance_computations"] for record in records) == summary["distance_computations"]
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_save_load(self):
+        names, ids = _random_names(1000)
+        queries = _random_queries(names, 50)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            resource_path = os.path.join(tmp_dir, "names.csv")
+
+            with open(resource_path, "w") as file:
+                file.write("\n".join(names))
+
+            for engine in ("scan", "bktree", "symspell", "qgram"):
+                normalizer = PrecisionOncologyNormalizer(enable_warnings=False, engine=engine)
+                normalizer.fit(names + names[:10], ids + ids[10:20])
+                file_path = os.path.join(tmp_dir, f"{engine}.preon")
+                normalizer.save(file_path, resource_path=resource_path)
+
+                for mmap in (True, False):
+                    loaded = PrecisionOncologyNormalizer.load(file_path, mmap=mmap, resource_path=resource_path)
+                    assert loaded.names == normalizer.names
+                    assert loaded.engine == engine
+
+                    if engine == "qgram":
+                        assert loaded._qgram_index.grams == normalizer._qgram_index.grams
+                        assert np.array_equal(loaded._qgram_index.rows, normalizer._qgram_index.rows)
+
+                    for query in queries:
+                        assert loaded.query(query) == normalizer.query(query)
+
+                # a loaded normalizer can be updated like the fitted one
+                for updated in (normalizer, loaded):
+                    updated.partial_fit(["Avastn", "Isavuconaconium"], ["ID-1", "ID-2"]).remove(names=names[:5])
+
+                for query in queries + ["Avastin", "Isavuconazonium"]:
+                    assert loaded.query(query) == normalizer.query(query)
+
+            with open(resource_path, "a") as file:
+                file.write("\nnewname")
+
+            self.assertRaises(ValueError, PrecisionOncologyNormalizer.load, file_path, resource_path=resource_path)
+
+
 class DrugNormalizationTest(unittest.TestCase):
 
     def test_store_load_resources(self):
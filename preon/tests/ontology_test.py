@@ -0,0 +1,30 @@
+import unittest
+
+from preon.ontology import HierarchyIndex
+
+
+class HierarchyIndexTest(unittest.TestCase):
+    def test_closure(self):
+        # breast carcinoma has two superclasses
+        index = HierarchyIndex(["DOID:162", "DOID:305", "DOID:1612", "DOID:3459", "DOID:3007"],
+                               [("DOID:305", "DOID:162"), ("DOID:1612", "DOID:162"), ("DOID:3459", "DOID:305"),
+                                ("DOID:3459", "DOID:1612"), ("DOID:3007", "DOID:3459")])
+
+        assert index.descendants("DOID:162") == ["DOID:162", "DOID:305", "DOID:1612", "DOID:3459", "DOID:3007"]
+        assert index.descendants("DOID:1612") == ["DOID:1612", "DOID:3459", "DOID:3007"]
+        assert index.ancestors("DOID:3007") == ["DOID:162", "DOID:305", "DOID:1612", "DOID:3459", "DOID:3007"]
+        assert index.ancestors("DOID:162") == ["DOID:162"]
+
+        with self.assertRaises(ValueError):
+            HierarchyIndex(["DOID:162", "DOID:305"], [("DOID:305", "DOID:162"), ("DOID:162", "DOID:305")])
+
+    def test_tree_numbers(self):
+        index = HierarchyIndex.from_tree_numbers(
+            ["MESH:D009369", "MESH:D000008", "MESH:D010534", "MESH:D009371"],
+            [["C04"], ["C04.588"], ["C04.588.033.513", "C04.588.699"], ["C04.5881"]])
+
+        # C04.5881 does not extend C04.588 (tree numbers are compared by segments)
+        assert index.descendants("MESH:D009369") == ["MESH:D009369", "MESH:D000008", "MESH:D010534", "MESH:D009371"]
+        assert index.descendants("MESH:D000008") == ["MESH:D000008", "MESH:D010534"]
+        assert index.ancestors("MESH:D010534") == ["MESH:D009369", "MESH:D000008", "MESH:D010534"]
+        assert index.ancestors("MESH:D009371") == ["MESH:D009369", "MESH:D009371"]
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import unittest
+import urllib.request
+
+from preon.benchmark import synthetic_names, synthetic_queries
+from preon.normalization import PrecisionOncologyNormalizer
+from preon.server import NormalizationServer, _to_json
+
+
+async def _request(port, method, path, payload=None, n_requests=1):
+    # sends requests over one connection and returns the status and JSON body of each response
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = b"" if payload is None else (payload if isinstance(payload, bytes) else json.dumps(payload).encode())
+    responses = []
+
+    for idx in range(n_requests):
+        connection = "close" if idx == n_requests - 1 else "keep-alive"
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: {connection}\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        headers = dict()
+
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n": break
+
+            key, _, value = line.decode().partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        responses.append((status, json.loads(await reader.readexactly(int(headers["content-length"])))))
+
+    writer.close()
+    return responses[0] if n_requests == 1 else responses
+
+
+async def _negative_length_request(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"POST /normalize HTTP/1.1\r\nHost: localhost\r\nContent-Length: -1\r\n\r\n")
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status, None
+
+
+class NormalizationServerTest(unittest.TestCase):
+
+    def setUp(self):
+        names, ids = synthetic_names(2000)
+        self.queries = synthetic_queries(names, 200)
+        self.normalizer = PrecisionOncologyNormalizer(enable_warnings=False).fit(names, ids)
+
+    def _run(self, coroutine, **server_args):
+        async def run():
+            server = NormalizationServer(self.normalizer, port=0, **server_args)
+            await server.start()
+
+            try:
+                return await coroutine(server)
+            finally:
+                await server.stop()
+
+        return asyncio.run(run())
+
+    def test_micro_batching(self):
+        async def run(server):
+            requests = [_request(server.port, "POST", "/normalize", {"names": self.queries[idx:idx + 2]})
+                        for idx in range(0, len(self.queries), 2)]
+            return await asyncio.gather(*requests), dict(server.stats)
+
+        responses, stats = self._run(run, max_batch_size=64)
+        results = [res for status, response in responses for res in response["results"]]
+
+        assert all(status == 200 for status, _ in responses)
+        assert results == [_to_json(query, self.normalizer.query(query)) for query in self.queries]
+
+        # concurrent requests are matched together
+        assert stats["requests"] == len(responses) and stats["names"] == len(self.queries)
+        assert stats["batches"] < len(responses)
+        assert stats["pending"] == 0
+
+    def test_query_args(self):
+        async def run(server):
+            loop = asyncio.get_running_loop()
+
+            # a regular HTTP client with a single name
+            request = urllib.request.Request(f"http://127.0.0.1:{server.port}/normalize", method="POST",
+                                             data=json.dumps({"name": "Ixabepilone Epothilone"}).encode())
+            response = await loop.run_in_executor(None, lambda: json.load(urllib.request.urlopen(request)))
+
+            return response, await _request(server.port, "POST", "/normalize",
+                                            {"names": self.queries, "match_type": "exact"}, n_requests=2)
+
+        self.normalizer.fit(["Ixabepilone", "Epothilone B"], ["ID1", "ID2"])
+        response, responses = self._run(run)
+
+        assert response["results"] == [_to_json("Ixabepilone Epothilone", self.normalizer.query("Ixabepilone Epothilone"))]
+        assert response["results"][0]["match_type"] == "substring"
+
+        for status, response in responses:
+            assert status == 200
+            assert all(res["match_type"] in ("exact", "none") for res in response["results"])
+
+    def test_errors(self):
+        async def run(server):
+            return [await _request(server.port, "POST", "/normalize", b"{"),
+                    await _request(server.port, "POST", "/normalize", {"names": [1, 2]}),
+                    await _request(server.port, "POST", "/normalize", {"names": ["a"], "threshold": "high"}),
+                    await _request(server.port, "GET", "/normalize"),
+                    await _request(server.port, "GET", "/unknown"),
+                    await _request(server.port, "POST", "/normalize", {"names": ["a"] * 11}),
+                    await _request(server.port, "POST", "/normalize", {"names": ["a"] * 1000}),
+                    await _negative_length_request(server.port),
+                    await _request(server.port, "GET", "/health")]
+
+        responses = self._run(run, max_pending=10, max_body_size=1000)
+        assert [status for status, _ in responses] == [400, 400, 400, 405, 404, 413, 413, 400, 200]
+        assert responses[-1][1]["rejected"] == 0
+
+    def test_backpressure(self):
+        async def run(server):
+            # the first request stays pending while its batch waits for further requests
+            first = asyncio.ensure_future(_request(server.port, "POST", "/normalize", {"names": ["a"] * 8}))
+            await asyncio.sleep(.1)
+
+            second = await _request(server.port, "POST", "/normalize", {"names": ["a"] * 4})
+            return await first, second, await _request(server.port, "GET", "/health")
+
+        first, second, health = self._run(run, max_pending=10, max_delay=.5)
+        assert (first[0], second[0], health[0]) == (200, 503, 200)
+        assert health[1]["rejected"] == 1